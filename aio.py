@@ -0,0 +1,199 @@
+import time
+import asyncio
+import logging
+import concurrent.futures
+from threading import Thread, Lock
+from weakref import WeakKeyDictionary, ref as weak_ref
+from typing import Optional, List, Tuple, Sequence, Coroutine
+
+import ibs
+import impl
+
+
+#
+# This file contains the logic for running asyncio extensions
+#
+# Extensions whose startup function is a coroutine run on a single event loop thread shared by every such extension,
+# instead of one thread each.  The capture threads notify the loop of new frames with call_soon_threadsafe, so waiting
+# for a frame never blocks the loop.  The loop runs on the time.monotonic clock, the same clock as frame timestamps, so
+# loop.call_at and asyncio.sleep can be used to schedule events relative to frames.
+#
+
+
+class _FrameNotifier:
+    """
+    Wakes coroutines waiting for new frames of a frame manager; Only used from the event loop thread, except for
+    _on_frame which is called from the capture thread
+    """
+    def __init__(self, fmang, loop: asyncio.AbstractEventLoop):
+        self._fmang = weak_ref(fmang)
+        self._loop = loop
+        self._waiters: List[Tuple[int, asyncio.Future]] = list()
+        fmang.listeners.append(self._on_frame)
+
+    def _on_frame(self, seq: Optional[int]):
+        try:
+            self._loop.call_soon_threadsafe(self._wake, seq)
+        except RuntimeError:
+            fmang = self._fmang()  # The loop was closed
+            if fmang is not None:
+                fmang.listeners.remove(self._on_frame)
+
+    def _wake(self, seq: Optional[int]):
+        waiters, self._waiters = self._waiters, list()
+        for after, future in waiters:
+            if future.done():
+                continue  # Timed out
+            if seq is None or seq > after:
+                future.set_result(None)
+            else:
+                self._waiters.append((after, future))
+
+    def wait(self, after: int) -> asyncio.Future:
+        future = self._loop.create_future()
+        self._waiters.append((after, future))
+        return future
+
+
+_notifiers: "WeakKeyDictionary[asyncio.AbstractEventLoop, WeakKeyDictionary]" = WeakKeyDictionary()
+
+
+def _notifier(fmang) -> _FrameNotifier:
+    loop = asyncio.get_running_loop()
+    notifiers = _notifiers.setdefault(loop, WeakKeyDictionary())
+    if fmang not in notifiers:
+        notifiers[fmang] = _FrameNotifier(fmang, loop)
+    return notifiers[fmang]
+
+
+class AsyncAPI(ibs.API):
+    """
+    API given to extensions whose startup function is a coroutine; The frame and data calls are awaitable, and never
+    block the event loop
+    """
+    async def wait_frame(self, after: int = -1, timeout: Optional[float] = None,
+                         source: Optional[str] = None) -> Optional[impl.FrameRef]:
+        """
+        Awaitable version of API.wait_frame
+
+        Example:
+            seq = -1
+            while running:
+                ref = await api.wait_frame(seq, timeout=1.0)
+                if ref is None:
+                    if api.finished():
+                        break
+                    continue
+                with ref:
+                    seq = ref.seq
+                    process(ref.frame, ref.timestamp)
+        """
+        fmang = impl.get(source)
+        after = self._pace(fmang, after)
+        notifier = _notifier(fmang)
+        loop = asyncio.get_running_loop()
+        deadline = None if timeout is None else loop.time() + timeout
+        while True:
+            # Returns immediately; A frame published after this check wakes the notifier registered below
+            ref = fmang.wait_frame(after, 0)
+            if ref is not None:
+                self.metrics.on_frame(ref.seq, ref.timestamp, time.monotonic())
+                return ref
+            if fmang.finished:
+                return None
+            remaining = None if deadline is None else deadline - loop.time()
+            if remaining is not None and remaining <= 0:
+                return None
+            try:
+                await asyncio.wait_for(notifier.wait(after), remaining)
+            except asyncio.TimeoutError:
+                return None
+
+    async def read_frame(self, source: Optional[str] = None):
+        """
+        Awaitable version of API.read_frame
+        """
+        return impl.get(source).read_frame()
+
+    async def read_synchronized(self, sources: Sequence[str], after: int = -1, timeout: Optional[float] = None):
+        """
+        Awaitable version of API.read_synchronized
+        """
+        ref = await self.wait_frame(after, timeout, sources[0])
+        if ref is None:
+            return None
+        refs = {sources[0]: ref}
+        for name in sources[1:]:
+            other = impl.get(name).borrow_closest(ref.timestamp)
+            if other is None:
+                for r in refs.values():
+                    r.release()
+                return None
+            refs[name] = other
+        return refs
+
+    async def send_data(self, data: bytes, timestamp: Optional[float] = None):
+        """
+        Awaitable version of API.send_data
+        """
+        super(AsyncAPI, self).send_data(data, timestamp)
+
+    async def send_values(self, channel: str, values: Sequence[float], timestamp: Optional[float] = None):
+        """
+        Awaitable version of API.send_values
+        """
+        super(AsyncAPI, self).send_values(channel, values, timestamp)
+
+    async def wait_landmarks(self, after: int = -1, timeout: Optional[float] = None):
+        """
+        Awaitable version of API.wait_landmarks; Waits on a worker thread of the event loop
+        """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, super(AsyncAPI, self).wait_landmarks, after, timeout)
+
+
+def is_async(func) -> bool:
+    return asyncio.iscoroutinefunction(func)
+
+
+_loop: Optional[asyncio.AbstractEventLoop] = None
+_th: Optional[Thread] = None
+_lock = Lock()
+
+
+def get_loop() -> asyncio.AbstractEventLoop:
+    """
+    Returns the event loop shared by every asyncio extension, starting it on first use
+    """
+    global _loop, _th
+    with _lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            _th = Thread(target=_loop.run_forever, name="aio", daemon=True)
+            _th.start()
+        return _loop
+
+
+def run(coro: Coroutine) -> concurrent.futures.Future:
+    """
+    Schedules a coroutine on the shared event loop; Exceptions are logged when the coroutine finishes
+    """
+    future = asyncio.run_coroutine_threadsafe(coro, get_loop())
+
+    def log_exception(f: concurrent.futures.Future):
+        if not f.cancelled() and f.exception() is not None:
+            logging.error("Asyncio extension failed", exc_info=f.exception())
+    future.add_done_callback(log_exception)
+    return future
+
+
+def stop():
+    global _loop, _th
+    with _lock:
+        if _loop is None:
+            return
+        _loop.call_soon_threadsafe(_loop.stop)
+        _th.join()
+        _loop.close()
+        _loop = None
+        _th = None
@@ -0,0 +1,159 @@
+import os
+import sys
+import time
+import json
+import logging
+import argparse
+from threading import Thread
+from typing import Optional, Type
+
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+
+from PyQt5.QtWidgets import QApplication
+
+import ibs
+import aio
+import impl
+import models
+import metrics
+import landmarks
+from main import discover_extensions
+
+
+#
+# Headless benchmark harness; Runs extensions without a camera or a window over a synthetic or recorded frame stream
+#
+
+
+def rss_mb() -> float:
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2 ** 20
+    except (OSError, ValueError):
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 2 ** 10
+
+
+def make_source(args, consumers: int = 1) -> impl.FrameSource:
+    if args.replay:
+        return impl.ReplaySource(args.replay, realtime=False, consumers=consumers)
+    width, height = (int(v) for v in args.size.split("x"))
+    return impl.SyntheticSource(width, height, args.frames, consumers=consumers)
+
+
+def bench_extension(ext_cls: Type[ibs.IbsExt], opt_cls: Optional[Type[ibs.IbsOpt]], args) -> dict:
+    name = ext_cls.get_name()
+    ext = ext_cls(opt_cls().get_config() if opt_cls else None)
+    impl.start(make_source(args, max(len(set(ext.get_frame_readers())), 1)))
+    rss = rss_mb()
+    errors = list()
+
+    def run():
+        try:
+            startup = ext.startup_ref()
+            if aio.is_async(startup):
+                aio.run(startup(aio.AsyncAPI(name), None)).result()
+            else:
+                startup(ibs.API(name), None)
+        except Exception as e:
+            errors.append(repr(e))
+
+    try:
+        start = time.monotonic()
+        th = Thread(target=run, daemon=True)
+        th.start()
+        while th.is_alive() and not impl.fmang.finished and time.monotonic() - start < args.duration:
+            time.sleep(0.05)
+        elapsed = time.monotonic() - start
+        shutdown = ext.shutdown_ref()
+        if aio.is_async(shutdown):
+            aio.run(shutdown()).result()
+        else:
+            shutdown()
+        th.join(timeout=5.0)
+    finally:
+        # The frame ring lives in shared memory, which outlives the process unless it is unlinked
+        landmarks.stop()
+        impl.stop()
+
+    result = metrics.get(name).summary()
+    if "landmarks" in metrics.extensions:
+        # The landmark service is restarted for every extension
+        result["landmarks"] = metrics.extensions.pop("landmarks").summary()
+    result["fps"] = result["frames"] / elapsed if elapsed > 0 else 0.0
+    result["rss_delta_mb"] = rss_mb() - rss
+    if errors:
+        result["error"] = errors[0]
+    return result
+
+
+def bench_functions(ext_cls: Type[ibs.IbsExt], args) -> dict:
+    results = dict()
+    benchmarks = ext_cls.get_benchmarks()
+    if not benchmarks:
+        return results
+    src = make_source(args)
+    frames = list()
+    while len(frames) < args.micro_frames:
+        ret, frame, _ = src.read()
+        if not ret:
+            break
+        frames.append(frame)
+    for name, prepare in benchmarks.items():
+        hist = metrics.Histogram()
+        for frame in frames:
+            run = prepare(frame)
+            t = time.perf_counter()
+            run()
+            hist.add(time.perf_counter() - t)
+        results[name] = hist.summary()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Headless extension benchmarks")
+    parser.add_argument("--ext", action="append", help="name of an extension to benchmark (default: all)")
+    parser.add_argument("--replay", metavar="PATH", help="recorded video, .npy frame array or image directory")
+    parser.add_argument("--size", default="640x480", help="synthetic frame size (default: 640x480)")
+    parser.add_argument("--frames", type=int, default=300, help="number of synthetic frames (default: 300)")
+    parser.add_argument("--duration", type=float, default=60.0, help="maximum seconds per extension (default: 60)")
+    parser.add_argument("--micro-frames", type=int, default=50,
+                        help="frames used for the extension micro benchmarks (default: 50)")
+    parser.add_argument("--output", metavar="PATH", help="write the results to a json file")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    app = QApplication(sys.argv[:1])  # Required to instantiate the extension options
+
+    results = dict()
+    for manifest in discover_extensions():
+        name = manifest.name
+        if args.ext and name not in args.ext:
+            continue
+        ext_cls, opt_cls = manifest.load(), manifest.load_options()
+        print("Benchmarking %s" % name, file=sys.stderr)
+        results[name] = bench_extension(ext_cls, opt_cls, args)
+        results[name]["functions"] = bench_functions(ext_cls, args)
+        models.end_session()
+
+    for name, r in results.items():
+        # Processing only covers the extension itself, latency also covers the framework work it waited on, such as
+        # the landmarks
+        print("%s: %.1f frames/s, processing p50 %.2f ms p99 %.2f ms, latency p50 %.2f ms p99 %.2f ms, rss %+.1f MB%s"
+              % (name, r["fps"], 1000 * r["processing"]["p50"], 1000 * r["processing"]["p99"],
+                 1000 * r["latency"]["p50"], 1000 * r["latency"]["p99"], r["rss_delta_mb"],
+                 ", error: %s" % r["error"] if "error" in r else ""))
+        if "landmarks" in r:
+            lm = r["landmarks"]
+            print("    landmarks: %d frames, processing p50 %.2f ms p99 %.2f ms" % (
+                lm["frames"], 1000 * lm["processing"]["p50"], 1000 * lm["processing"]["p99"]))
+        for fname, f in r["functions"].items():
+            print("    %s: p50 %.2f ms, p99 %.2f ms" % (fname, 1000 * f["p50"], 1000 * f["p99"]))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+    del app
+
+
+if __name__ == "__main__":
+    main()
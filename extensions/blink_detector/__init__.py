@@ -1,12 +1,12 @@
-from typing import Optional
+from typing import Optional, List
 
-from PyQt5.QtWidgets import QCheckBox
 from PyQt5.QtWidgets import QWidget
-from PyQt5.QtWidgets import QVBoxLayout
 
 import ibs
 from ibs import LayoutHint
-from . import main
+from .options import Options
+
+# The detector (dlib, OpenCV) is imported by the methods below, so listing the extension on the startup window is fast
 
 
 class Extension(ibs.IbsExt):
@@ -14,20 +14,34 @@ class Extension(ibs.IbsExt):
         super(Extension, self).__init__(options)
 
         self.use_gui = options["use_gui"]
+        self.use_process = options["use_process"]
 
     @staticmethod
     def get_name() -> str:
         return "Blink Detection"
 
+    @staticmethod
+    def get_benchmarks():
+        from . import main
+        return main.benchmarks()
+
+    @staticmethod
+    def preload():
+        from . import main
+        main.preload()
+
     def startup_ref(self):
+        from . import main
         return main.startup
 
     def shutdown_ref(self):
+        from . import main
         return main.shutdown
 
     def get_guicfg(self) -> Optional[ibs.IbsGuiCfg]:
         class GuiCfg(ibs.IbsGuiCfg):
             def get_widget(self) -> QWidget:
+                from . import main
                 return main.BlinkDetector()
 
             def get_layout(self) -> LayoutHint:
@@ -38,19 +52,14 @@ class Extension(ibs.IbsExt):
         else:
             return None
 
+    def get_capture_config(self) -> Optional[ibs.CaptureConfig]:
+        # Landmarks are found on 500 pixel wide frames, so higher resolutions are wasted
+        return ibs.CaptureConfig(width=640, height=480, fps=30)
 
-class Options(ibs.IbsOpt):
-    # noinspection PyArgumentList
-    def __init__(self):
-        super(Options, self).__init__()
-
-        self.dsp_button = QCheckBox("Show Videofeed")
-
-        layout = QVBoxLayout()
-        layout.addWidget(self.dsp_button)
-        self.setLayout(layout)
+    def get_frame_readers(self) -> List[str]:
+        # Only the landmark service reads every frame; The preview borrows the frame of each result
+        return ["landmarks"]
 
-    def get_config(self):
-        return {
-            "use_gui": self.dsp_button.isChecked()
-        }
+    def run_in_process(self) -> bool:
+        # Without the video feed nothing needs the GUI thread
+        return self.use_process and not self.use_gui
@@ -1,48 +1,195 @@
+import os
+import sys
+from typing import List, Tuple, Optional
+
 import cv2
 import dlib
 import numpy as np
 import imutils
-from imutils import face_utils
-from scipy.spatial import distance as dist
+
+if __name__ == "__main__":
+    # Run as a script (python detector.py); The face tracker is part of the framework, at the root of the repository
+    sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", ".."))
+from landmarks import FaceTracker  # noqa: E402
 
 mdl_pth = "./extensions/blink_detector/shape_predictor_68_face_landmarks.dat"
 
+# Indices of the eye landmarks in the 68 point model (36-41: left eye, 42-47: right eye)
+eye_idxs = range(36, 48)
+
 
 class Model:
-    def __init__(self):
-        self.hog_extractor = dlib.get_frontal_face_detector()
-        self.classifier = dlib.shape_predictor(mdl_pth)
+    def __init__(self, track: bool = False, redetect: int = 10, roi_pad: Optional[float] = None, hog_extractor=None,
+                 classifier=None):
+        """
+        Args:
+            track: Reuse the face rectangles of the previous frame instead of running the HOG detector on every frame
+            redetect: When tracking, the number of frames between full frame detections
+            roi_pad: When tracking, run the HOG detector only inside the previous face rectangles padded by this
+                fraction of their size, instead of reusing the rectangles as is
+            hog_extractor: dlib face detector, loaded if not given; Must not be shared with other threads
+            classifier: dlib landmark predictor, loaded from mdl_pth if not given
+        """
+        self.hog_extractor = hog_extractor if hog_extractor is not None else dlib.get_frontal_face_detector()
+        self.classifier = classifier if classifier is not None else dlib.shape_predictor(mdl_pth)
+        # The same tracking as the landmark service of the framework
+        self.tracker = FaceTracker(self.hog_extractor, track, redetect, roi_pad)
+
+        # Buffers reused across calls to avoid per frame allocations
+        self._grays: List[np.ndarray] = list()
+        self._kpts = np.empty((4, len(eye_idxs), 2), dtype=int)
+
+    def _gray(self, i: int, img: np.ndarray) -> np.ndarray:
+        if i == len(self._grays):
+            self._grays.append(np.empty(img.shape[:2], dtype=np.uint8))
+        elif self._grays[i].shape != img.shape[:2]:
+            self._grays[i] = np.empty(img.shape[:2], dtype=np.uint8)
+        return cv2.cvtColor(img, cv2.COLOR_BGR2GRAY, dst=self._grays[i])
+
+    def _reserve(self, n: int):
+        if n > len(self._kpts):
+            kpts = np.empty((max(n, 2 * len(self._kpts)), len(eye_idxs), 2), dtype=int)
+            kpts[:len(self._kpts)] = self._kpts
+            self._kpts = kpts
+
+    def forward_batch(self, imgs: List[np.ndarray],
+                      grays: Optional[List[np.ndarray]] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Runs face detection and eye landmark prediction over a batch of frames
+
+        Args:
+            imgs: BGR frames
+            grays: Grayscale versions of the frames if they are already available
+
+        Returns:
+            (kpts, frame_idxs); kpts: [n_faces, 12, 2] eye landmarks, frame_idxs: [n_faces] index of the source frame of
+            each face.  kpts is a view of a buffer owned by the model, and is overwritten by the next call
+        """
+        frame_idxs = list()
+        n = 0
+        for i, img in enumerate(imgs):
+            gray = grays[i] if grays is not None else self._gray(i, img)
+            rects = self.tracker.detect(gray)
+            self._reserve(n + len(rects))
+            for f, rect in enumerate(rects):
+                shape = self.classifier(gray, rect)
+                kpts = self._kpts[n]
+                for j, k in enumerate(eye_idxs):
+                    p = shape.part(k)
+                    kpts[j, 0] = p.x
+                    kpts[j, 1] = p.y
+                if self.tracker.track and self.tracker.follow(f, rect, kpts.mean(axis=0)) is None:
+                    continue  # The landmarks are not trusted on tracking loss
+                frame_idxs.append(i)
+                n += 1
+            self.tracker.end_frame()
+        return self._kpts[:n], np.array(frame_idxs, dtype=int)
+
+    def forward(self, img: np.ndarray, gray: Optional[np.ndarray] = None):
+        kpts, _ = self.forward_batch([img], [gray] if gray is not None else None)
+        return list(kpts.copy())
+
 
-    def forward(self, img: np.ndarray):
-        gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-        kpts_set = list()
-        rects = self.hog_extractor(gray, 1)
-        for i, rect in enumerate(rects):
-            shape = self.classifier(gray, rect)
-            shape = face_utils.shape_to_np(shape)
-            kpts_set.append(shape[36:48])
-        return kpts_set
+def measure_batch(kpts: np.ndarray) -> np.ndarray:
+    """
+    Computes the eye aspect ratio of both eyes for many sets of eye landmarks at once
+
+    Args:
+        kpts: [n, 12, 2] eye landmarks as returned by Model.forward_batch
+
+    Returns:
+        [n, 2] eye aspect ratios; [:, 0] left eye, [:, 1] right eye
+    """
+    eyes = np.asarray(kpts, dtype=np.float64).reshape(-1, 2, 6, 2)  # [n, eye, point, xy]
+    # Vertical distances p1-p5 and p2-p4, horizontal distance p0-p3
+    vert = np.linalg.norm(eyes[:, :, [1, 2]] - eyes[:, :, [5, 4]], axis=-1).sum(axis=-1)
+    horz = np.linalg.norm(eyes[:, :, 0] - eyes[:, :, 3], axis=-1)
+    return vert / (2 * horz)
 
 
 def measure(kpts):
-    wl = dist.euclidean(kpts[0], kpts[3])
-    h2l = sum([
-        dist.euclidean(kpts[1], kpts[5]),
-        dist.euclidean(kpts[2], kpts[4]),
-    ])
-    wr = dist.euclidean(kpts[6], kpts[9])
-    h2r = sum((
-        dist.euclidean(kpts[7], kpts[11]),
-        dist.euclidean(kpts[8], kpts[10]),
-    ))
-    return h2l / (2 * wl), h2r / (2 * wr)
+    lval, rval = measure_batch(kpts[np.newaxis])[0]
+    return float(lval), float(rval)
+
+
+class OnlineBlinkDetector:
+    """
+    Detects blinks from a stream of eye aspect ratios by thresholding with hysteresis; The eye is considered closed once
+    the ratio falls below close_thresh, and open again once it rises above open_thresh.  Closures shorter than
+    min_duration are ignored.
+    """
+    START = 1
+    END = 0
+
+    def __init__(self, close_thresh: float = 0.2, open_thresh: float = 0.25, min_duration: float = 0.05):
+        self.close_thresh = close_thresh
+        self.open_thresh = open_thresh
+        self.min_duration = min_duration
+        self._closed_at: Optional[float] = None
+        self._started = False
+
+    def update(self, ear: float, t: float) -> List[Tuple[int, float, float]]:
+        """
+        Returns:
+            List of (event, start time, duration) events; event is START once a closure lasts min_duration (duration is
+            nan), and END when the eye reopens after a blink
+        """
+        events = list()
+        if self._closed_at is None:
+            if ear < self.close_thresh:
+                self._closed_at = t
+        elif ear > self.open_thresh:
+            if self._started:
+                events.append((self.END, self._closed_at, t - self._closed_at))
+            self._closed_at = None
+            self._started = False
+        if self._closed_at is not None and not self._started and t - self._closed_at >= self.min_duration:
+            events.append((self.START, self._closed_at, float("nan")))
+            self._started = True
+        return events
+
+
+class BlinkSummary:
+    """
+    Per second summary statistics of the blink detection
+    """
+    def __init__(self, period: float = 1.0):
+        self.period = period
+        self._start: Optional[float] = None
+        self._reset()
+
+    def _reset(self):
+        self.frames = 0
+        self.faces = 0
+        self.blinks = 0
+        self._ears = np.zeros((2,), dtype=np.float64)
+
+    def update(self, t: float, ears: Optional[Tuple[float, float]], blinks: int) -> Optional[Tuple[float, ...]]:
+        """
+        Returns:
+            (frames, frames with a face, blinks, mean left ratio, mean right ratio) once a period has passed
+        """
+        row = None
+        if self._start is None:
+            self._start = t
+        elif t - self._start >= self.period:
+            mean = self._ears / self.faces if self.faces else (float("nan"), float("nan"))
+            row = (self.frames, self.faces, self.blinks, mean[0], mean[1])
+            self._start += self.period * ((t - self._start) // self.period)
+            self._reset()
+        self.frames += 1
+        self.blinks += blinks
+        if ears is not None:
+            self.faces += 1
+            self._ears += ears
+        return row
 
 
 def main():
     global mdl_pth
-    mdl_pth = "./shape_predictor_68_face_landmarks.dat"
+    mdl_pth = os.path.join(os.path.dirname(os.path.abspath(__file__)), "shape_predictor_68_face_landmarks.dat")
 
-    mdl = Model()
+    mdl = Model(track=True)
     cap = cv2.VideoCapture(0)
 
     while True:
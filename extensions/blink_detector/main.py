@@ -1,12 +1,14 @@
 import time
 import math
+from typing import Optional
 
 import cv2
-import imutils
+import dlib
 import numpy as np
 from PyQt5 import QtGui
 from PyQt5.QtCore import Qt
-from PyQt5.QtCore import QPoint
+from PyQt5.QtCore import QPointF
+from PyQt5.QtCore import QTimer
 from PyQt5.QtGui import QImage
 from PyQt5.QtGui import QPixmap
 from PyQt5.QtGui import QPolygonF
@@ -15,14 +17,22 @@ from PyQt5.QtWidgets import QLabel
 from PyQt5.QtWidgets import QVBoxLayout, QHBoxLayout
 
 import ibs
-from .detector import Model, measure
+from . import detector
+from .detector import Model, OnlineBlinkDetector, BlinkSummary, measure, eye_idxs
 
 running = True
 
 
 class TimeGraph(QWidget):
     # noinspection PyArgumentList
-    def __init__(self, retention=30.0, ymin=0.0, ymax=1.0, back_color="white", data_color="red"):
+    def __init__(self, retention=30.0, ymin=0.0, ymax=1.0, back_color="white", data_color="red", max_rate=120.0,
+                 fps=30.0):
+        """
+        Args:
+            retention: Number of seconds of data shown
+            max_rate: Highest expected rate of add_point calls per second; Sets the capacity of the data buffer
+            fps: Maximum number of repaints per second
+        """
         super(TimeGraph, self).__init__()
 
         self.setMinimumWidth(320)
@@ -32,8 +42,13 @@ class TimeGraph(QWidget):
         self.xscale = 1 / retention
         self.yoffset = ymin
 
+        # Fixed capacity ring buffer; The oldest points are overwritten once full
         self.retention = retention
-        self.data = list()
+        capacity = int(retention * max_rate)
+        self.times = np.zeros((capacity,), dtype=np.float64)
+        self.values = np.zeros((capacity,), dtype=np.float64)
+        self.start = 0
+        self.count = 0
 
         self.data_pen = QtGui.QPen()
         self.data_pen.setColor(QtGui.QColor(data_color))
@@ -46,14 +61,38 @@ class TimeGraph(QWidget):
         self.back_brush.setColor(QtGui.QColor(back_color))
         self.back_brush.setStyle(Qt.SolidPattern)
 
-    def add_point(self, p):
-        self.data.append((time.time(), p))
+        self.timer = QTimer(self)
+        self.timer.timeout.connect(self.update)
+        self.timer.start(int(1000 / fps))
+
+    def add_point(self, p, t=None):
+        capacity = len(self.times)
+        end = (self.start + self.count) % capacity
+        self.times[end] = time.time() if t is None else t
+        self.values[end] = p
+        if self.count < capacity:
+            self.count += 1
+        else:
+            self.start = (self.start + 1) % capacity
+
+    def _ordered(self):
+        # Returns the buffered points from oldest to newest
+        end = self.start + self.count
+        if end <= len(self.times):
+            return self.times[self.start:end], self.values[self.start:end]
+        end %= len(self.times)
+        return (np.concatenate((self.times[self.start:], self.times[:end])),
+                np.concatenate((self.values[self.start:], self.values[:end])))
 
     def paintEvent(self, event):
-        # This is not efficient, but without using C idk how to make it better
         t = time.time()
-        while len(self.data) != 0 and t - self.data[0][0] > self.retention:
-            del self.data[0]
+
+        # Evicting expired points in a single step
+        times, values = self._ordered()
+        expired = int(np.searchsorted(times, t - self.retention, side="right"))
+        self.start = (self.start + expired) % len(self.times)
+        self.count -= expired
+        times, values = times[expired:], values[expired:]
 
         painter = QtGui.QPainter()
         painter.begin(self)
@@ -67,16 +106,16 @@ class TimeGraph(QWidget):
         painter.drawRect(0, 0, width, height)
 
         painter.setPen(self.data_pen)
-        data_points = [
-            QPoint(
-                int(width * (self.xscale * (x - t) + 1)),
-                int(height * (1 - self.yscale * (y - self.yoffset)))
-            ) for x, y in self.data
-        ]
-        painter.drawPolyline(QPolygonF(data_points))
+        xs = (width * (self.xscale * (times - t) + 1)).astype(np.int64)
+        ys = height * (1 - self.yscale * (values - self.yoffset))
+        if len(xs) > 2 * width:
+            # Min/max decimation down to two points per pixel column, which draws identically to the full data
+            cols = np.concatenate(([0], np.flatnonzero(np.diff(xs)) + 1))
+            xs = np.repeat(xs[cols], 2)
+            ys = np.stack((np.maximum.reduceat(ys, cols), np.minimum.reduceat(ys, cols)), axis=1).ravel()
+        painter.drawPolyline(QPolygonF([QPointF(x, y) for x, y in zip(xs.tolist(), ys.tolist())]))
 
         painter.end()
-        self.update()
 
 
 class ImgDsp(QLabel):
@@ -124,24 +163,94 @@ class BlinkDetector(QWidget):
         layout.addWidget(gwidget)
         self.setLayout(layout)
 
+    def add_ratios(self, lval, rval, t):
+        self.lgraph.add_point(lval, t)
+        self.rgraph.add_point(rval, t)
+
+
+def load_model(**kwargs) -> Model:
+    # The landmark predictor (~100 MB) is shared with other extensions using the same file, and kept between sessions.
+    # dlib face detectors keep scratch buffers, so every thread gets its own
+    hog_extractor = ibs.API.model("dlib.get_frontal_face_detector", dlib.get_frontal_face_detector, thread_safe=False)
+    classifier = ibs.API.model(detector.mdl_pth, lambda: dlib.shape_predictor(detector.mdl_pth), resident=True)
+    return Model(hog_extractor=hog_extractor, classifier=classifier, **kwargs)
+
+
+def preload():
+    # Loads the landmark model while the startup window is shown
+    ibs.API.register_landmark_model(detector.mdl_pth)
+    ibs.API.preload_landmarks()
+
 
-def startup(api, widget: BlinkDetector):
-    mdl = Model()
+def startup(api, widget: Optional[BlinkDetector]):
+    api.register_landmark_model(detector.mdl_pth)  # When preload was not run, such as in bench.py
+    blinks = OnlineBlinkDetector()
+    summary = BlinkSummary()
 
     if widget:
-        while running:
-            frame: np.ndarray = api.read_frame()
-            frame = imutils.resize(frame, width=500)
-            kpts_set = mdl.forward(frame)
-            kpts = None
-            if len(kpts_set) > 0:
-                kpts = kpts_set[0]
-                lval, rval = measure(kpts)
-                widget.lgraph.add_point(lval)
-                widget.rgraph.add_point(rval)
-            widget.webcam.show_img(frame, kpts)
-    else:
-        raise NotImplementedError("Blink detection without showing video is not implemented")
+        # Widgets are only updated from the GUI thread
+        show_img = api.gui_slot(widget.webcam.show_img)
+        add_ratios = api.gui_slot(widget.add_ratios, coalesce=False)
+    seq = -1
+    while running:
+        # The landmarks are computed by the framework, and shared with other face based extensions
+        faces = api.wait_landmarks(seq, timeout=1.0)
+        if faces is None:
+            if api.landmarks_finished():
+                break  # The replayed recording is over
+            continue
+        seq, stamp = faces.seq, faces.timestamp
+        kpts = None
+        ears = None
+        events = list()
+        if len(faces) > 0:
+            kpts = faces.points[0, eye_idxs]
+            ears = measure(kpts)
+            api.send_values("ear", ears, stamp)
+            events = blinks.update(sum(ears) / 2, stamp)
+            for event in events:
+                api.send_values("blinks", event, event[1])
+        row = summary.update(stamp, ears, sum(1 for e in events if e[0] == OnlineBlinkDetector.END))
+        if row is not None:
+            api.send_values("summary", row, stamp)
+
+        if widget:
+            if ears is not None:
+                add_ratios.post(ears[0], ears[1], time.time())
+            # Drawing the landmarks over the frame they were computed from, rather than the most recent one
+            ref = api.borrow_closest(stamp)
+            if ref is None:
+                continue
+            with ref:
+                # Views are shared with other extensions, so the resize happens once per frame
+                frame = ref.view(width=500)
+                scale = frame.shape[1] / ref.frame.shape[1]
+            show_img.post(frame, (kpts * scale).astype(int) if kpts is not None else None)
+
+
+def benchmarks():
+    mdl = load_model()
+    # Used when no face is found in the benchmark frame
+    eye = [[0, 2], [1, 1], [2, 1], [3, 2], [2, 3], [1, 3]]
+    fallback = np.array(eye + [[x + 6, y] for x, y in eye], dtype=int)
+
+    def resize(frame):
+        h, w = frame.shape[:2]
+        return cv2.resize(frame, (500, int(h * 500 / w)), interpolation=cv2.INTER_AREA)
+
+    def forward(frame):
+        frame = resize(frame)
+        return lambda: mdl.forward(frame)
+
+    def measure_eyes(frame):
+        kpts_set = mdl.forward(resize(frame))
+        kpts = kpts_set[0] if len(kpts_set) > 0 else fallback
+        return lambda: measure(kpts)
+
+    return {
+        "detector.Model.forward": forward,
+        "detector.measure": measure_eyes,
+    }
 
 
 def shutdown():
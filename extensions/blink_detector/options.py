@@ -0,0 +1,24 @@
+from PyQt5.QtWidgets import QCheckBox
+from PyQt5.QtWidgets import QVBoxLayout
+
+import ibs
+
+
+class Options(ibs.IbsOpt):
+    # noinspection PyArgumentList
+    def __init__(self):
+        super(Options, self).__init__()
+
+        self.dsp_button = QCheckBox("Show Videofeed")
+        self.proc_button = QCheckBox("Run in Separate Process (without videofeed)")
+
+        layout = QVBoxLayout()
+        layout.addWidget(self.dsp_button)
+        layout.addWidget(self.proc_button)
+        self.setLayout(layout)
+
+    def get_config(self):
+        return {
+            "use_gui": self.dsp_button.isChecked(),
+            "use_process": self.proc_button.isChecked()
+        }
@@ -0,0 +1,245 @@
+import time
+import logging
+import importlib
+import multiprocessing as mp
+from collections import deque
+from threading import Thread, Lock
+from multiprocessing.shared_memory import SharedMemory
+from typing import Optional, Dict, List, Sequence
+
+import numpy as np
+
+import ibs
+import impl
+import landmarks
+
+
+#
+# This file contains the logic for running extensions in their own process
+#
+# Frames are never copied between processes.  The child attaches to the shared memory frame ring of impl._FrameManager,
+# and the parent borrows frames on behalf of the child, so the slots are not overwritten while the child reads them.
+# Only small messages go through the pipe between the processes:
+#   child -> parent: ("borrow",), ("wait", after, timeout), ("closest", timestamp), ("release", slot),
+#                    ("data", payload, timestamp), ("values", channel, values, timestamp),
+#                    ("landmarks", after, timeout), ("stats",), ("finished",), ("landmarks_finished",)
+#   parent -> child: ("frame", slot, seq, timestamp, scale), ("none",), landmarks.Landmarks or None, capture statistics,
+#                    bool
+#
+# The governor of the extension runs in the parent, which sees the time between frames requested by the child; Its
+# resolution scale is forwarded with every frame
+#
+
+
+class _ChildFrames:
+    """
+    Child process counterpart of impl._FrameManager; Borrows frames through the parent
+    """
+    def __init__(self, conn, shm_name: str, shape, dtype: str):
+        self._conn = conn
+        self._lock = Lock()
+        self._shm = SharedMemory(name=shm_name)
+        self._slots = np.ndarray(shape, dtype=np.dtype(dtype), buffer=self._shm.buf)
+        self.views = impl._ViewCache()
+        self.scale = 1.0
+        self._deferred = deque()  # Slots of references released by the garbage collector
+
+    def _flush_deferred(self):
+        # Must be called with self._lock held
+        while self._deferred:
+            self._conn.send(("release", self._deferred.popleft()))
+
+    def _request(self, *msg) -> Optional[impl.FrameRef]:
+        with self._lock:
+            self._flush_deferred()
+            self._conn.send(msg)
+            reply = self._conn.recv()
+        if reply[0] == "none":
+            return None
+        _, slot, seq, stamp, self.scale = reply
+        self.views.evict_before(seq - len(self._slots))
+        return impl.FrameRef(self, slot, seq, stamp)
+
+    def call(self, *msg):
+        with self._lock:
+            self._flush_deferred()
+            self._conn.send(msg)
+            return self._conn.recv()
+
+    def _release(self, slot: int):
+        with self._lock:
+            self._flush_deferred()
+            self._conn.send(("release", slot))
+
+    def _release_deferred(self, slot: int):
+        # Lock free; Sent with the next message to the parent
+        self._deferred.append(slot)
+
+    def send(self, *msg):
+        with self._lock:
+            self._flush_deferred()
+            self._conn.send(msg)
+
+    def borrow_frame(self) -> impl.FrameRef:
+        return self._request("borrow")
+
+    def wait_frame(self, after: int = -1, timeout: Optional[float] = None) -> Optional[impl.FrameRef]:
+        return self._request("wait", after, timeout)
+
+    def borrow_closest(self, timestamp: float) -> Optional[impl.FrameRef]:
+        return self._request("closest", timestamp)
+
+    def read_frame(self):
+        with self.borrow_frame() as ref:
+            return ref.frame.copy()
+
+
+class ProcessAPI(ibs.API):
+    """
+    API given to extensions running in their own process; Frames are read from the shared frame ring, and data is
+    forwarded to the parent process for serialization
+    """
+    def __init__(self, ext: str, frames: _ChildFrames):
+        super(ProcessAPI, self).__init__(ext)
+        self._frames = frames
+
+    @staticmethod
+    def _check_source(source: Optional[str]):
+        if source not in (None, impl.DEFAULT):
+            raise NotImplementedError("Extensions running in a separate process can only read the default source")
+
+    def read_frame(self, source: Optional[str] = None):
+        self._check_source(source)
+        return self._frames.read_frame()
+
+    def borrow_frame(self, source: Optional[str] = None) -> impl.FrameRef:
+        self._check_source(source)
+        return self._frames.borrow_frame()
+
+    def wait_frame(self, after: int = -1, timeout: Optional[float] = None,
+                   source: Optional[str] = None) -> Optional[impl.FrameRef]:
+        self._check_source(source)
+        return self._frames.wait_frame(after, timeout)
+
+    def borrow_closest(self, timestamp: float, source: Optional[str] = None) -> Optional[impl.FrameRef]:
+        self._check_source(source)
+        return self._frames.borrow_closest(timestamp)
+
+    def read_synchronized(self, sources: Sequence[str], after: int = -1, timeout: Optional[float] = None):
+        raise NotImplementedError("Extensions running in a separate process can only read the default source")
+
+    def sources(self) -> List[str]:
+        return [impl.DEFAULT]
+
+    def capture_stats(self, source: Optional[str] = None) -> Dict[str, float]:
+        self._check_source(source)
+        return self._frames.call("stats")
+
+    def finished(self, source: Optional[str] = None) -> bool:
+        self._check_source(source)
+        return self._frames.call("finished")
+
+    def wait_landmarks(self, after: int = -1, timeout: Optional[float] = None):
+        return self._frames.call("landmarks", after, timeout)
+
+    def landmarks_finished(self) -> bool:
+        return self._frames.call("landmarks_finished")
+
+    def scaled(self, size: int) -> int:
+        return max(int(size * self._frames.scale), 1)
+
+    def send_data(self, data: bytes, timestamp: Optional[float] = None):
+        self._frames.send("data", data, timestamp)
+
+    def send_values(self, channel: str, values: Sequence[float], timestamp: Optional[float] = None):
+        self._frames.send("values", channel, list(values), timestamp)
+
+
+def _child_main(module: str, options, name: str, ring, conn, stop):
+    ext: ibs.IbsExt = importlib.import_module(module).Extension(options)
+    frames = _ChildFrames(conn, *ring)
+
+    def watch_stop():
+        # Polling instead of waiting on an event; A waiter which dies with the process would block setting the event
+        while not stop.value:
+            time.sleep(0.1)
+        ext.shutdown_ref()()
+    Thread(target=watch_stop, daemon=True).start()
+
+    ext.startup_ref()(ProcessAPI(name, frames), None)
+
+
+class ExtProcess:
+    """
+    Runs an extension in a child process; Extensions running in a process do not get a widget
+    """
+    def __init__(self, ext: ibs.IbsExt, api: ibs.API):
+        ctx = mp.get_context("spawn")
+        self._api = api
+        self._conn, child_conn = ctx.Pipe()
+        self._stop = ctx.Value("b", 0)
+        self._borrowed: Dict[int, List[impl.FrameRef]] = dict()
+        self._proc = ctx.Process(
+            target=_child_main,
+            args=(type(ext).__module__, ext.options, ext.get_name(), impl.fmang.shared_ring, child_conn, self._stop),
+            daemon=True
+        )
+        self._proc.start()
+        child_conn.close()
+        self._th = Thread(target=self._serve, daemon=True)
+        self._th.start()
+
+    def _lend(self, ref: Optional[impl.FrameRef]):
+        if ref is None:
+            self._conn.send(("none",))
+            return
+        self._borrowed.setdefault(ref._slot, list()).append(ref)
+        self._conn.send(("frame", ref._slot, ref.seq, ref.timestamp, self._api.governor.scale))
+
+    def _serve(self):
+        try:
+            while True:
+                msg = self._conn.recv()
+                if msg[0] == "wait":
+                    self._lend(self._api.wait_frame(msg[1], msg[2]))
+                elif msg[0] == "borrow":
+                    self._lend(impl.fmang.borrow_frame())
+                elif msg[0] == "closest":
+                    self._lend(impl.fmang.borrow_closest(msg[1], read=False))
+                elif msg[0] == "landmarks":
+                    self._conn.send(self._api.wait_landmarks(msg[1], msg[2]))
+                elif msg[0] == "stats":
+                    self._conn.send(impl.fmang.capture_stats())
+                elif msg[0] == "finished":
+                    self._conn.send(impl.fmang.finished)
+                elif msg[0] == "landmarks_finished":
+                    self._conn.send(landmarks.finished())
+                elif msg[0] == "release":
+                    self._borrowed[msg[1]].pop().release()
+                elif msg[0] == "data":
+                    self._api.send_data(msg[1], msg[2])
+                elif msg[0] == "values":
+                    self._api.send_values(msg[1], msg[2], msg[3])
+        except (EOFError, OSError):
+            pass  # The child process exited
+        for refs in self._borrowed.values():
+            for ref in refs:
+                ref.release()
+        self._borrowed.clear()
+
+    @property
+    def pending(self) -> int:
+        """
+        Number of frames currently borrowed by the child process
+        """
+        return sum(len(refs) for refs in self._borrowed.values())
+
+    def stop(self, timeout: float = 5.0):
+        if self._proc.is_alive():  # The extension may have returned or failed already
+            self._stop.value = 1
+        self._proc.join(timeout)
+        if self._proc.is_alive():
+            logging.warning("Extension process %s did not shut down, terminating it" % self._api.extname)
+            self._proc.terminate()
+            self._proc.join()
+        self._th.join()
@@ -0,0 +1,78 @@
+import logging
+from typing import Optional
+
+import impl
+
+
+#
+# This file contains the logic for degrading the input of extensions gracefully when they can not keep up
+#
+
+
+class Governor:
+    """
+    Adapts the input resolution and frame rate of an extension to hold its per-frame processing time near a target;
+    The resolution is lowered first, then frames are subsampled.  Both are restored in the reverse order once there is
+    headroom again.
+    """
+    scales = (1.0, 0.8, 0.64, 0.5, 0.4)
+
+    def __init__(self, target: Optional[float] = None, window: int = 30, max_stride: int = 4, name: str = ""):
+        """
+        Args:
+            target: Target processing time per frame in seconds; Defaults to the frame period of the camera
+            window: Number of frames between adjustments
+            max_stride: Largest number of frames advanced per processed frame
+        """
+        self.target = target
+        self.window = window
+        self.max_stride = max_stride
+        self.name = name
+        self.level = 0
+        self.stride = 1
+        self._avg: Optional[float] = None
+        self._seen = 0
+
+    @property
+    def scale(self) -> float:
+        return self.scales[self.level]
+
+    def scaled(self, size: int) -> int:
+        return max(int(size * self.scale), 1)
+
+    def _target(self) -> float:
+        if self.target is not None:
+            return self.target
+        fps = impl.fmang.fps if impl.fmang is not None else 0.0
+        return 1 / fps if fps > 0 else 1 / 30
+
+    def observe(self, processing: float):
+        # Exponential moving average over roughly one window
+        alpha = 2 / (self.window + 1)
+        self._avg = processing if self._avg is None else alpha * processing + (1 - alpha) * self._avg
+        self._seen += 1
+        if self._seen < self.window:
+            return
+        self._seen = 0
+
+        target = self._target()
+        budget = self.stride * target  # Time available per processed frame when skipping stride - 1 frames
+        level, stride = self.level, self.stride
+        if self._avg > 1.1 * budget:
+            if self.level < len(self.scales) - 1:
+                self.level += 1
+            elif self.stride < self.max_stride:
+                self.stride += 1
+        elif self.stride > 1:
+            # Only stepping down once the frames fit the smaller budget, so the stride doesn't oscillate
+            if self._avg < 0.6 * (self.stride - 1) * target:
+                self.stride -= 1
+        elif self._avg < 0.6 * target and self.level > 0:
+            self.level -= 1
+        if (level, stride) != (self.level, self.stride):
+            logging.info("%s: %.1f ms per frame for a %.1f ms budget, now at %d%% resolution with a stride of %d" % (
+                self.name, 1000 * self._avg, 1000 * budget, 100 * self.scale, self.stride))
+            self._avg = None  # Measuring the new setting from scratch
+
+    def summary(self) -> dict:
+        return {"scale": self.scale, "stride": self.stride}
@@ -1,32 +1,384 @@
+import time
 import logging
 from abc import ABC
+from collections import deque
 from threading import Lock
-from typing import Callable, Tuple, Optional
+from typing import Callable, Tuple, Optional, Sequence, Dict, List
+
+import numpy as np
 
 from PyQt5.QtCore import Qt
+from PyQt5.QtCore import QObject
+from PyQt5.QtCore import pyqtSignal
+from PyQt5.QtCore import pyqtSlot
 from PyQt5.QtWidgets import QWidget
+from PyQt5.QtWidgets import QApplication
 
 import impl
 import config
+import metrics
+import models
+import governor
+import landmarks
+import serialization
+from impl import CaptureConfig  # Returned by IbsExt.get_capture_config
+
+
+class GuiSlot(QObject):
+    """
+    Delivers values posted from an extension thread to a handler which runs on the GUI thread
+    """
+    _posted = pyqtSignal()
+
+    def __init__(self, handler: Callable, coalesce: bool = True):
+        super(GuiSlot, self).__init__()
+        self._handler = handler
+        self._coalesce = coalesce
+        self._lock = Lock()
+        self._pending = deque()
+        self._scheduled = False
+        self.dropped = 0
+
+        self._posted.connect(self._deliver, Qt.QueuedConnection)
+        app = QApplication.instance()
+        if app is not None:
+            self.moveToThread(app.thread())
+
+    def post(self, *args):
+        """
+        Queues a call of the handler with the given arguments on the GUI thread; Never blocks on the GUI
+        """
+        with self._lock:
+            if self._coalesce:
+                # Latest wins; Calls the GUI has not gotten to yet are dropped
+                self.dropped += len(self._pending)
+                self._pending.clear()
+            self._pending.append(args)
+            if self._scheduled:
+                return
+            self._scheduled = True
+        self._posted.emit()
+
+    @pyqtSlot()
+    def _deliver(self):
+        with self._lock:
+            pending = list(self._pending)
+            self._pending.clear()
+            self._scheduled = False
+        for args in pending:
+            self._handler(*args)
 
 
 class API:
     def __init__(self, ext: str):
         self.extname = ext
         self.log = logging
+        self._sid = serialization.register(ext)
+        self._channels: Dict[str, Optional[int]] = dict()
+        self.metrics = metrics.get(ext)
+        self.governor = governor.Governor(name=ext)
+        self.metrics.governor = self.governor
 
     @staticmethod
-    def read_frame():
+    def read_frame(source: Optional[str] = None):
         """
         Retrieves a frame from the webcam; Ensures compatibility with other extensions
 
+        Args:
+            source: Name of the frame source (see sources); None reads from the default webcam
+
         Returns:
             Numpy array with raw frame data: [height, width, 3]; 0 < ret[:,:,:] < 255
         """
-        return impl.fmang.read_frame()
+        return impl.get(source).read_frame()
 
-    def send_data(self, data: bytes):
-        pass
+    @staticmethod
+    def borrow_frame(source: Optional[str] = None) -> impl.FrameRef:
+        """
+        Borrows the most recent webcam frame without copying it; The frame must be released once it is no longer needed
+        so the slot can be reused by the framework.  The borrowed frame is read-only and is invalid after release.
+
+        Example:
+            with api.borrow_frame() as ref:
+                process(ref.frame)
+
+        Args:
+            source: Name of the frame source (see sources); None borrows from the default webcam
+
+        Returns:
+            Frame reference with attributes frame: [height, width, 3] read-only numpy array, seq: frame index, and
+            timestamp: time.monotonic() capture time
+        """
+        return impl.get(source).borrow_frame()
+
+    @staticmethod
+    def borrow_closest(timestamp: float, source: Optional[str] = None) -> Optional[impl.FrameRef]:
+        """
+        Borrows the frame still in the ring captured closest to a time.monotonic() time; Passing the timestamp of a
+        result, such as the landmarks of wait_landmarks, borrows the very frame the result was computed from
+
+        Example:
+            ref = api.borrow_closest(faces.timestamp)
+            if ref is not None:
+                with ref:
+                    draw(ref.frame, faces.points)
+
+        Args:
+            timestamp: Capture time of the frame
+            source: Name of the frame source (see sources); None borrows from the default webcam
+
+        Returns:
+            Frame reference (see borrow_frame); None if no frame has been captured yet
+        """
+        # Not a read of the frame, so fast replays wait for the extensions which do read it
+        return impl.get(source).borrow_closest(timestamp, read=False)
+
+    @staticmethod
+    def capture_stats(source: Optional[str] = None) -> Dict[str, float]:
+        """
+        Timing of the most recent frames of a source, in seconds; Use it to judge how precisely frame timestamps can be
+        aligned with other events
+
+        Returns:
+            interval: Mean time between frames, jitter: Standard deviation of the time between frames, max_interval:
+            Longest time between frames, delay: Mean time from capture until the frame is available, max_delay: Longest
+            time from capture until the frame is available
+        """
+        return impl.get(source).capture_stats()
+
+    @staticmethod
+    def finished(source: Optional[str] = None) -> bool:
+        """
+        Whether a finite frame source, such as a replayed recording, has no more frames; Once finished, wait_frame and
+        read_synchronized return None without blocking, so extensions should leave their loop
+        """
+        return impl.get(source).finished
+
+    @staticmethod
+    def sources() -> List[str]:
+        """
+        Names of the available frame sources; The default webcam is named "default"
+        """
+        return list(impl.sources)
+
+    def wait_frame(self, after: int = -1, timeout: Optional[float] = None,
+                   source: Optional[str] = None) -> Optional[impl.FrameRef]:
+        """
+        Blocks until a frame newer than the given sequence number has been captured, then borrows it without copying;
+        Gaps between the sequence numbers of consecutive frames indicate frames which were never seen by the caller.
+        When the extension can not keep up with the camera, the framework may skip frames (see scaled).
+
+        Example:
+            seq = -1
+            while running:
+                ref = api.wait_frame(seq, timeout=1.0)
+                if ref is None:
+                    if api.finished():
+                        break
+                    continue
+                with ref:
+                    seq = ref.seq
+                    process(ref.frame, ref.timestamp)
+
+        Args:
+            after: Sequence number of the last frame processed by the caller; -1 returns the current frame
+            timeout: Maximum number of seconds to wait for the frame; None waits indefinitely
+            source: Name of the frame source (see sources); None waits on the default webcam
+
+        Returns:
+            Frame reference (see borrow_frame); None if the timeout expired or the source is finished (see finished)
+        """
+        fmang = impl.get(source)
+        after = self._pace(fmang, after)
+        ref = fmang.wait_frame(after, timeout)
+        if ref is not None:
+            self.metrics.on_frame(ref.seq, ref.timestamp, time.monotonic())
+        return ref
+
+    def read_synchronized(self, sources: Sequence[str], after: int = -1,
+                          timeout: Optional[float] = None) -> Optional[Dict[str, impl.FrameRef]]:
+        """
+        Waits for a new frame of the first source, and borrows the frames of the other sources captured closest to it
+
+        Example:
+            seq = -1
+            while running:
+                refs = api.read_synchronized(["default", "eye"], seq, timeout=1.0)
+                if refs is None:
+                    if api.finished("default"):
+                        break
+                    continue
+                seq = refs["default"].seq
+                process(refs["default"].frame, refs["eye"].frame)
+                for ref in refs.values():
+                    ref.release()
+
+        Args:
+            sources: Names of the frame sources; The first one paces the reads
+            after: Sequence number of the last frame of the first source processed by the caller
+            timeout: Maximum number of seconds to wait for the frame of the first source; None waits indefinitely
+
+        Returns:
+            Source name -> frame reference (see borrow_frame); None if the timeout expired or a source is finished
+        """
+        after = self._pace(impl.get(sources[0]), after)
+        refs = impl.read_synchronized(list(sources), after, timeout)
+        if refs is not None:
+            ref = refs[sources[0]]
+            self.metrics.on_frame(ref.seq, ref.timestamp, time.monotonic())
+        return refs
+
+    def _pace(self, fmang, after: int) -> int:
+        # Lets the governor skip frames of live sources when the extension falls behind
+        processing = self.metrics.on_wait(time.monotonic())
+        if fmang.realtime:
+            if processing is not None:
+                self.governor.observe(processing)
+            if after >= 0:
+                after += self.governor.stride - 1
+        return after
+
+    def wait_landmarks(self, after: int = -1, timeout: Optional[float] = None) -> Optional[landmarks.Landmarks]:
+        """
+        Blocks until the facial landmarks of a frame newer than the given sequence number are available; The landmarks
+        are computed once per frame by the framework and shared by every extension asking for them, which is much
+        cheaper than running a landmark model in each extension.
+
+        Example:
+            seq = -1
+            while running:
+                faces = api.wait_landmarks(seq, timeout=1.0)
+                if faces is None:
+                    if api.landmarks_finished():
+                        break
+                    continue
+                seq = faces.seq
+                if len(faces) > 0:
+                    left_eye = faces.points[0, 36:42]
+
+        Args:
+            after: Sequence number of the last frame processed by the caller; -1 returns the most recent landmarks
+            timeout: Maximum number of seconds to wait; None waits indefinitely
+
+        Returns:
+            Landmarks with the face rectangles ([n, 4] left, top, right, bottom) and the 68 point dlib landmarks
+            ([n, 68, 2] x, y) of every face, in frame pixels; None if the timeout expired or the landmarks are finished
+            (see landmarks_finished)
+        """
+        self.metrics.on_wait(time.monotonic())
+        faces = landmarks.wait(self.extname, after, timeout)
+        if faces is not None:
+            self.metrics.on_frame(faces.seq, faces.timestamp, time.monotonic())
+        return faces
+
+    @staticmethod
+    def landmarks_finished() -> bool:
+        """
+        Whether no more landmarks will be computed, because the frame source is finished; Once finished,
+        wait_landmarks returns None without blocking
+        """
+        return landmarks.finished()
+
+    @staticmethod
+    def register_landmark_model(path: str):
+        """
+        Registers the 68 point dlib landmark model (shape_predictor_68_face_landmarks.dat) used by wait_landmarks; The
+        framework does not ship one, so extensions asking for landmarks register the model they bundle, from
+        IbsExt.preload and before their first wait_landmarks.  Only the first model registered is used
+        """
+        landmarks.register_predictor(path)
+
+    @staticmethod
+    def preload_landmarks():
+        """
+        Loads the landmark model used by wait_landmarks; Meant to be called from IbsExt.preload, after
+        register_landmark_model
+        """
+        landmarks.preload()
+
+    @staticmethod
+    def model(key: str, loader: Callable[[], object], thread_safe: bool = True, resident: bool = False):
+        """
+        Returns a model shared with every other extension, loading it on first use; Extensions asking for the same key
+        get the same instance, so the model is loaded and kept in memory only once.
+
+        Example:
+            predictor = api.model(path, lambda: dlib.shape_predictor(path))
+
+        Args:
+            key: Identifier of the model, usually the path of the model file
+            loader: Function loading the model; Only called if the model is not loaded yet
+            thread_safe: Whether the model may be called from several threads at once; Otherwise every thread gets its
+                own instance
+            resident: Keep the model loaded between sessions
+        """
+        return models.get(key, loader, thread_safe, resident)
+
+    def scaled(self, size: int) -> int:
+        """
+        Scales an input size, such as the width frames are resized to, by the resolution chosen for the extension by
+        the framework; The resolution is lowered while the extension takes longer than a frame period per frame, and
+        raised again when it has headroom.
+
+        Example:
+            frame = ref.view(width=api.scaled(500))
+        """
+        return self.governor.scaled(size)
+
+    @staticmethod
+    def gui_slot(handler: Callable, coalesce: bool = True) -> GuiSlot:
+        """
+        Creates a thread-safe path for updating a widget from the extension thread; Qt widgets must only be accessed
+        from the GUI thread, so widget updates should be posted through a slot rather than called directly.
+
+        Example:
+            show = api.gui_slot(widget.show_img)
+            while running:
+                ...
+                show.post(frame)
+
+        Args:
+            handler: Function called on the GUI thread with the posted arguments
+            coalesce: Only deliver the most recent post when the GUI falls behind (eg. video frames); Otherwise every
+                post is delivered (eg. data points)
+
+        Returns:
+            Slot whose post(*args) method queues a call of the handler
+        """
+        return GuiSlot(handler, coalesce)
+
+    def send_data(self, data: bytes, timestamp: Optional[float] = None):
+        """
+        Records data to the session file; Never blocks on disk I/O as records are queued and written in batches by a
+        background thread
+
+        Args:
+            data: Record payload, the format of which is defined by the extension
+            timestamp: time.monotonic() time the data refers to, eg. the timestamp of the frame it was measured from;
+                Defaults to the current time
+        """
+        if self._sid is not None:
+            serialization.writer.submit(self._sid, serialization.DATA, data, timestamp)
+
+    def send_values(self, channel: str, values: Sequence[float], timestamp: Optional[float] = None):
+        """
+        Records a row of numeric values to the session file; Every row sent on a channel must have the same length.
+        Unlike send_data, value channels are compacted into typed columns after the session for fast loading.
+
+        Example:
+            api.send_values("ear", (left_ear, right_ear), ref.timestamp)
+
+        Args:
+            channel: Name of the channel within the extension
+            values: Row of values, stored as float64
+            timestamp: See send_data
+        """
+        if channel not in self._channels:
+            self._channels[channel] = serialization.register("%s/%s" % (self.extname, channel))
+        sid = self._channels[channel]
+        if sid is not None:
+            payload = np.asarray(values, dtype=np.float64).tobytes()
+            serialization.writer.submit(sid, serialization.VALUES, payload, timestamp)
 
 
 class LayoutHint(int):
@@ -80,6 +432,10 @@ class IbsExt:
         raise NotImplementedError()
 
     def startup_ref(self) -> Callable[[API, QWidget], None]:
+        """
+        Startup function of the extension, called on a thread of its own; If it is a coroutine function (async def),
+        it runs on the event loop shared by every asyncio extension instead, and gets an aio.AsyncAPI
+        """
         raise NotImplementedError()
 
     def shutdown_ref(self) -> Callable[[], None]:
@@ -89,6 +445,48 @@ class IbsExt:
     def get_guicfg(self) -> Optional[IbsGuiCfg]:
         return None
 
+    @staticmethod
+    def get_benchmarks() -> Dict[str, Callable[[np.ndarray], Callable[[], None]]]:
+        """
+        Optional micro benchmarks run by bench.py; Each benchmark is a function which prepares a run from a frame, and
+        returns the function being timed
+        """
+        return dict()
+
+    # noinspection PyMethodMayBeStatic
+    def get_capture_config(self) -> Optional[CaptureConfig]:
+        """
+        Camera mode the extension needs; The camera is opened in the smallest mode satisfying every extension, so
+        request the lowest resolution and frame rate the extension works well with.  None leaves it up to the others
+        """
+        return None
+
+    # noinspection PyMethodMayBeStatic
+    def get_frame_readers(self) -> List[str]:
+        """
+        Names of the readers of every frame of the default source the extension relies on; Readers shared by several
+        extensions, such as "landmarks" for api.wait_landmarks, are counted once.  When a recording is replayed as fast
+        as possible, each frame is held until every reader has borrowed it, so no reader skips a frame
+        """
+        return [self.get_name()]
+
+    @staticmethod
+    def preload():
+        """
+        Optional hook for loading and warming up models; Called on a background thread as soon as the extension is
+        selected on the startup window, and the main window is only shown once it returns.  Whatever is loaded should
+        be cached at module level for startup to pick up
+        """
+        pass
+
+    # noinspection PyMethodMayBeStatic
+    def run_in_process(self) -> bool:
+        """
+        Whether the extension runs in its own process instead of a thread of the main process; Extensions running in a
+        process are not affected by the GIL, but do not get a widget and their options must be picklable
+        """
+        return False
+
 
 class IbsOpt(QWidget):
     """
@@ -1,7 +1,10 @@
+import os
 import time
 import logging
-from threading import Thread, Lock
-from typing import Optional
+from collections import deque
+from threading import Thread, Lock, Condition, Event
+from multiprocessing.shared_memory import SharedMemory
+from typing import Optional, List, Tuple, Dict, Callable
 
 import cv2
 import numpy as np
@@ -12,46 +15,706 @@ import numpy as np
 #
 
 
-class _FrameManager:  # Singleton
+class FrameRef:
+    """
+    Read-only view of a frame slot borrowed from the frame manager.  The slot will not be overwritten by the capture
+    thread until the reference is released, either explicitly with release() or by leaving a with block.
+    """
+    def __init__(self, fmang: "_FrameManager", slot: int, seq: int, timestamp: float):
+        self._fmang = fmang
+        self._slot = slot
+        self.seq = seq
+        self.timestamp = timestamp
+        self.frame: np.ndarray = fmang._slots[slot].view()
+        self.frame.flags.writeable = False
+
+    def view(self, width: Optional[int] = None, height: Optional[int] = None,
+             color: Optional[int] = None) -> np.ndarray:
+        """
+        Derived view of the frame; Views are computed once per frame and shared read-only across extensions
+
+        Args:
+            width: Width to resize to; The aspect ratio is kept if only one of width and height is given
+            height: Height to resize to
+            color: OpenCV color conversion code applied after resizing, eg. cv2.COLOR_BGR2GRAY
+        """
+        return self._fmang.views.get(self, width, height, color)
+
+    def release(self):
+        if self._fmang is not None:
+            self._fmang._release(self._slot)
+            self._fmang = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.release()
+
+    def __del__(self):
+        # Never taking a lock here; The garbage collector may finalize a leaked reference on a thread which is holding
+        # the lock of the frame manager, so the release is queued instead
+        if self._fmang is not None:
+            self._fmang._release_deferred(self._slot)
+            self._fmang = None
+
+
+class _View:
+    def __init__(self):
+        self.ready = Event()
+        self.value: Optional[np.ndarray] = None
+
+
+class _ViewCache:
+    """
+    Cache of derived frame views keyed by frame sequence number and transform
+    """
     def __init__(self):
+        self._lock = Lock()
+        self._views: Dict[int, Dict[Tuple, _View]] = dict()
+
+    def get(self, ref: FrameRef, width: Optional[int], height: Optional[int], color: Optional[int]) -> np.ndarray:
+        if width is None and height is None and color is None:
+            return ref.frame
+        key = (width, height, color)
+        with self._lock:
+            views = self._views.setdefault(ref.seq, dict())
+            view = views.get(key)
+            compute = view is None
+            if compute:
+                view = views[key] = _View()
+        if not compute:
+            # Another extension is computing or has computed the view
+            view.ready.wait()
+            return view.value
+
+        try:
+            if color is not None:
+                # Resized views are cached as well, so the color conversion can reuse them
+                value = cv2.cvtColor(self.get(ref, width, height, None), color)
+            else:
+                h, w = ref.frame.shape[:2]
+                if height is None:
+                    height = int(h * width / w)
+                elif width is None:
+                    width = int(w * height / h)
+                value = cv2.resize(ref.frame, (width, height), interpolation=cv2.INTER_AREA)
+            value.flags.writeable = False
+            view.value = value
+        except Exception:
+            with self._lock:
+                self._views.get(ref.seq, dict()).pop(key, None)
+            raise
+        finally:
+            view.ready.set()
+        return view.value
+
+    def evict(self, seq: int):
+        with self._lock:
+            self._views.pop(seq, None)
+
+    def evict_before(self, seq: int):
+        with self._lock:
+            for s in [s for s in self._views if s < seq]:
+                del self._views[s]
+
+
+class FrameSource:
+    """
+    Abstract frame source interface
+    """
+    # Whether frames are produced at their own rate (cameras, paced replay) or as fast as they are consumed
+    realtime = True
+
+    def read(self, buf: Optional[np.ndarray] = None) -> Tuple[bool, Optional[np.ndarray], float]:
+        """
+        Reads the next frame, into buf when its shape matches the frame
+
+        Returns:
+            (ret, frame, timestamp); ret is False on a failed read, timestamp is on the time.monotonic() clock
+        """
+        raise NotImplementedError()
+
+    def grab(self) -> bool:
+        """
+        Skips the next frame
+        """
+        return self.read()[0]
+
+    @property
+    def finished(self) -> bool:
+        return False
+
+    def close(self):
+        pass
+
+
+class CaptureConfig:
+    """
+    Camera mode requested by an extension; Fields left as None are up to the camera
+    """
+    def __init__(self, width: Optional[int] = None, height: Optional[int] = None, fps: Optional[float] = None,
+                 fourcc: Optional[str] = None, buffer_size: Optional[int] = None):
+        """
+        Args:
+            width: Frame width in pixels
+            height: Frame height in pixels
+            fps: Frame rate
+            fourcc: Pixel format of the camera, eg. "MJPG" (compressed, needed for high resolutions and frame rates over
+                USB 2) or "YUYV" (uncompressed)
+            buffer_size: Number of frames buffered by the camera driver
+        """
+        self.width = width
+        self.height = height
+        self.fps = fps
+        self.fourcc = fourcc
+        self.buffer_size = buffer_size
+
+    def __repr__(self):
+        return "CaptureConfig(%s)" % ", ".join("%s=%r" % (k, v) for k, v in vars(self).items() if v is not None)
+
+    @staticmethod
+    def union(configs: List[Optional["CaptureConfig"]]) -> "CaptureConfig":
+        """
+        Smallest mode satisfying every config; The largest width and the largest height (each over the configs giving
+        it), the highest frame rate and the smallest buffer.  Conflicting pixel formats are resolved in favour of the
+        first one
+        """
+        configs = [c for c in configs if c is not None]
+        out = CaptureConfig()
+        widths = [c.width for c in configs if c.width]
+        out.width = max(widths) if widths else None
+        heights = [c.height for c in configs if c.height]
+        out.height = max(heights) if heights else None
+        fps = [c.fps for c in configs if c.fps]
+        out.fps = max(fps) if fps else None
+        fourccs = [c.fourcc for c in configs if c.fourcc]
+        if len(set(fourccs)) > 1:
+            logging.warning("Extensions request conflicting pixel formats %s, using %s" % (fourccs, fourccs[0]))
+        out.fourcc = fourccs[0] if fourccs else None
+        buffers = [c.buffer_size for c in configs if c.buffer_size]
+        out.buffer_size = min(buffers) if buffers else None
+        return out
+
+
+class WebcamSource(FrameSource):
+    def __init__(self, device: int = 0, config: Optional[CaptureConfig] = None, low_latency: bool = False,
+                 max_drain: int = 4):
+        """
+        Args:
+            device: Camera index
+            config: Camera mode
+            low_latency: Keep the driver buffer drained, so frames are processed as soon as they are captured instead of
+                waiting in the buffer
+            max_drain: In low latency mode, the maximum number of buffered frames discarded per read
+        """
+        self._cap = cv2.VideoCapture(device)
+        if not self._cap:
+            raise RuntimeError("Unable to retrieve a webcam")
+        self.low_latency = low_latency
+        self.max_drain = max_drain
+        self.drained = 0  # Number of stale frames discarded in low latency mode
+        if low_latency:
+            config = CaptureConfig(**vars(config)) if config is not None else CaptureConfig()
+            config.buffer_size = 1
+        if config is not None:
+            self.configure(config)
+
+    def configure(self, config: CaptureConfig):
+        # The pixel format goes first, as it limits the resolutions and frame rates available
+        if config.fourcc:
+            self._cap.set(cv2.CAP_PROP_FOURCC, cv2.VideoWriter_fourcc(*config.fourcc))
+        if config.width:
+            self._cap.set(cv2.CAP_PROP_FRAME_WIDTH, config.width)
+        if config.height:
+            self._cap.set(cv2.CAP_PROP_FRAME_HEIGHT, config.height)
+        if config.fps:
+            self._cap.set(cv2.CAP_PROP_FPS, config.fps)
+        if config.buffer_size:
+            self._cap.set(cv2.CAP_PROP_BUFFERSIZE, config.buffer_size)
+
+        code = int(self._cap.get(cv2.CAP_PROP_FOURCC))
+        actual = CaptureConfig(
+            int(self._cap.get(cv2.CAP_PROP_FRAME_WIDTH)), int(self._cap.get(cv2.CAP_PROP_FRAME_HEIGHT)),
+            self._cap.get(cv2.CAP_PROP_FPS), "".join(chr((code >> 8 * i) & 0xFF) for i in range(4)),
+            int(self._cap.get(cv2.CAP_PROP_BUFFERSIZE)))
+        logging.info("Requested camera mode %s, got %s" % (config, actual))
+        for field in ("width", "height", "fps", "fourcc"):
+            if getattr(config, field) and getattr(config, field) != getattr(actual, field):
+                logging.warning("The camera does not support %s %s" % (field, getattr(config, field)))
+
+    def read(self, buf: Optional[np.ndarray] = None) -> Tuple[bool, Optional[np.ndarray], float]:
+        if not self._cap.isOpened():
+            raise RuntimeError("Webcam closed unexpectedly")
+        if not self.low_latency:
+            ret, frame = self._cap.read(buf)
+            return ret, frame, time.monotonic()
+
+        # Grabbing and decoding separately, so the frame is stamped as soon as the driver hands it over.  A grab which
+        # returns immediately got a frame which was already waiting in the buffer, so it is discarded in favour of the
+        # next one; Not every backend honours CAP_PROP_BUFFERSIZE
+        start = time.monotonic()
+        if not self._cap.grab():
+            return False, None, start
+        stamp = time.monotonic()
+        for _ in range(self.max_drain):
+            if stamp - start > 0.002:
+                break
+            start = stamp
+            if not self._cap.grab():
+                return False, None, start
+            stamp = time.monotonic()
+            self.drained += 1
+        ret, frame = self._cap.retrieve(buf)
+        return ret, frame, stamp
+
+    def grab(self) -> bool:
+        return self._cap.grab()
+
+    def close(self):
+        self._cap.release()
+
+
+class ReplaySource(FrameSource):
+    """
+    Replays a recorded session from a video file, a .npy array of frames [n, height, width, 3], or a directory of image
+    files (replayed in sorted filename order)
+    """
+    def __init__(self, path: str, realtime: bool = True, fps: float = 30.0, consumers: int = 1):
+        """
+        Args:
+            path: Recording to replay
+            realtime: Replay at the recorded timestamps; Otherwise frames are replayed as fast as they are consumed
+            fps: Frame rate assumed for recordings without timestamps (.npy arrays and image directories)
+            consumers: When not replaying in realtime, the number of borrows each frame waits for before it is replaced
+        """
+        self.realtime = realtime
+        self.consumers = consumers
+        self._period = 1 / fps
+        self._idx = 0
+        self._cap = None
+        self._frames = None
+        self._files = None
+        if os.path.isdir(path):
+            self._files = sorted(os.path.join(path, f) for f in os.listdir(path))
+            self._files = [f for f in self._files if cv2.haveImageReader(f)]
+        elif path.endswith(".npy"):
+            self._frames = np.load(path, mmap_mode="r")
+        else:
+            self._cap = cv2.VideoCapture(path)
+            if not self._cap.isOpened():
+                raise RuntimeError("Unable to open recording %s" % path)
+        self._done = False
+        self._t0 = None
+
+    @property
+    def finished(self) -> bool:
+        return self._done
+
+    def _next(self, buf: Optional[np.ndarray]) -> Tuple[bool, Optional[np.ndarray], float]:
+        # Returns the next recorded frame and its offset in seconds from the start of the recording
+        if self._cap is not None:
+            ret, frame = self._cap.read(buf)
+            return ret, frame, self._cap.get(cv2.CAP_PROP_POS_MSEC) / 1000
+        offset = self._idx * self._period
+        if self._frames is not None:
+            if self._idx >= len(self._frames):
+                return False, None, offset
+            frame = self._frames[self._idx]
+        else:
+            if self._idx >= len(self._files):
+                return False, None, offset
+            frame = cv2.imread(self._files[self._idx])
+        self._idx += 1
+        if buf is not None and frame is not None and buf.shape == frame.shape:
+            buf[...] = frame
+            frame = buf
+        return frame is not None, frame, offset
+
+    def read(self, buf: Optional[np.ndarray] = None) -> Tuple[bool, Optional[np.ndarray], float]:
+        ret, frame, offset = self._next(buf)
+        if not ret:
+            self._done = True
+            return False, None, time.monotonic()
+        if not self.realtime:
+            return True, frame, time.monotonic()
+        if self._t0 is None:
+            self._t0 = time.monotonic() - offset
+        stamp = self._t0 + offset
+        delay = stamp - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+        return True, frame, stamp
+
+    def close(self):
+        if self._cap is not None:
+            self._cap.release()
+
+
+class SyntheticSource(FrameSource):
+    """
+    Generates a deterministic moving test pattern, for benchmarking without a camera or recording
+    """
+    def __init__(self, width: int = 640, height: int = 480, frames: int = 300, realtime: bool = False,
+                 fps: float = 30.0, consumers: int = 1):
+        self.realtime = realtime
+        self.consumers = consumers
+        self.frames = frames
+        self._period = 1 / fps
+        self._idx = 0
+        self._t0 = None
+
+        ys, xs = np.mgrid[0:height, 0:width]
+        self._base = np.stack((xs * 255 // width, ys * 255 // height, (xs + ys) * 255 // (width + height)), axis=-1)
+        self._base = self._base.astype(np.uint8)
+
+    @property
+    def finished(self) -> bool:
+        return self._idx >= self.frames
+
+    def read(self, buf: Optional[np.ndarray] = None) -> Tuple[bool, Optional[np.ndarray], float]:
+        if self.finished:
+            return False, None, time.monotonic()
+        if self._t0 is None:
+            self._t0 = time.monotonic()
+        frame = np.roll(self._base, 4 * self._idx, axis=1)
+        if buf is not None and buf.shape == frame.shape:
+            buf[...] = frame
+            frame = buf
+        stamp = self._t0 + self._idx * self._period
+        self._idx += 1
+        if self.realtime:
+            delay = stamp - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+        else:
+            stamp = time.monotonic()
+        return True, frame, stamp
+
+
+class _FrameManager:  # Singleton
+    def __init__(self, source: FrameSource, nslots: int = 8):
         self._cap_lock = Lock()
         with self._cap_lock:
-            self._cap = cv2.VideoCapture(0)
-            if not self._cap:
-                raise RuntimeError("Unable to retrieve a webcam")
-            ret, frame = self._cap.read()
+            self._src = source
+            ret, frame, stamp = self._src.read()
         if not ret:
             raise RuntimeError("Unable to access the video camera")
-        self.frame = frame
-        th = Thread(target=self._read_webcam, daemon=True)
 
+        # Preallocated ring of frame slots; the capture thread only ever writes into a slot which is neither the most
+        # recent frame nor borrowed by a reader, so readers never need to copy and the capture thread never waits.
+        # The ring lives in shared memory so extensions running in other processes can borrow frames as well
+        shape = (nslots,) + frame.shape
+        self._shm = SharedMemory(create=True, size=int(np.prod(shape)) * frame.dtype.itemsize)
+        self._slots = np.ndarray(shape, dtype=frame.dtype, buffer=self._shm.buf)
+        self._slots[0][...] = frame
+        self._seqs: List[int] = [-1] * nslots
+        self._seqs[0] = 0
+        self._stamps: List[float] = [0.0] * nslots
+        self._stamps[0] = stamp
+        self._refs: List[int] = [0] * nslots
+        self._deferred: deque = deque()  # Slots of references released by the garbage collector
+        self.dropped = 0  # Frames dropped because every slot was borrowed
+        self._drop_logged = 0.0
+        self._reads = 0  # Number of borrows of the most recent frame
+        self._head = 0
+        self.finished = False
         self._lock = Lock()
-        th.start()
+        self._new_frame = Condition(self._lock)
+        self._frame_read = Condition(self._lock)
+        self.views = _ViewCache()
+
+        # Capture intervals and the delays from capture until frames are published, for the capture statistics
+        self._intervals: deque = deque(maxlen=300)
+        self._delays: deque = deque(maxlen=300)
+
+        # Called from the capture thread with a borrowed reference to every new frame; Taps must never block, and
+        # their borrows do not count as reads of the frame
+        self.taps: List[Callable[[FrameRef], None]] = list()
+        # Called from the capture thread with the sequence number of every new frame, and with None once the source has
+        # finished; Listeners must never block
+        self.listeners: List[Callable[[Optional[int]], None]] = list()
+
+        self._running = True
+        self._th = Thread(target=self._read_frames, daemon=True)
+        self._th.start()
+
+    @property
+    def shape(self):
+        return self._slots.shape[1:]
+
+    @property
+    def realtime(self) -> bool:
+        return self._src.realtime
+
+    @property
+    def fps(self) -> float:
+        """
+        Capture rate measured over the frames currently in the ring
+        """
+        with self._lock:
+            stamps = [t for t, seq in zip(self._stamps, self._seqs) if seq >= 0]
+            seqs = [seq for seq in self._seqs if seq >= 0]
+        if len(seqs) < 2 or max(stamps) <= min(stamps):
+            return 0.0
+        return (max(seqs) - min(seqs)) / (max(stamps) - min(stamps))
+
+    def capture_stats(self) -> Dict[str, float]:
+        """
+        Statistics of the most recent frames, in seconds: The mean interval between frames and its standard deviation
+        (jitter), the longest interval, and the mean and longest delay from capture until frames are available to
+        extensions
+        """
+        intervals = np.array(self._intervals)
+        delays = np.array(self._delays)
+        if len(intervals) == 0:
+            return {"interval": 0.0, "jitter": 0.0, "max_interval": 0.0, "delay": 0.0, "max_delay": 0.0}
+        return {
+            "interval": float(intervals.mean()),
+            "jitter": float(intervals.std()),
+            "max_interval": float(intervals.max()),
+            "delay": float(delays.mean()),
+            "max_delay": float(delays.max()),
+        }
+
+    @property
+    def shared_ring(self):
+        """
+        Shared memory name, shape and dtype of the frame ring, for attaching to it from another process
+        """
+        return self._shm.name, self._slots.shape, self._slots.dtype.str
+
+    def close(self):
+        self._running = False
+        with self._lock:
+            self._frame_read.notify_all()
+        self._th.join(timeout=2.0)
+        with self._cap_lock:
+            self._src.close()
+        self._slots = None
+        try:
+            self._shm.close()
+        except BufferError:
+            logging.warning("Frames are still borrowed while closing the frame manager")
+        self._shm.unlink()
+
+    def _borrow(self) -> FrameRef:
+        # Must be called with self._lock held
+        slot = self._head
+        self._refs[slot] += 1
+        self._reads += 1
+        self._frame_read.notify()
+        return FrameRef(self, slot, self._seqs[slot], self._stamps[slot])
+
+    def borrow_frame(self) -> FrameRef:
+        with self._lock:
+            return self._borrow()
+
+    def wait_frame(self, after: int = -1, timeout: Optional[float] = None) -> Optional[FrameRef]:
+        with self._new_frame:
+            if not self._new_frame.wait_for(lambda: self._seqs[self._head] > after or self.finished, timeout):
+                return None
+            if self._seqs[self._head] <= after:
+                return None  # The source has no more frames
+            return self._borrow()
+
+    def borrow_closest(self, timestamp: float, read: bool = True) -> Optional[FrameRef]:
+        """
+        Borrows the frame in the ring captured closest to the given time.monotonic() time; None if the ring is empty
+
+        Args:
+            timestamp: Capture time of the frame
+            read: Whether borrowing the most recent frame counts as a read of it, which lets sources replayed as fast
+                as they are consumed advance; False for borrowing a frame already read, such as the frame of a result
+        """
+        with self._lock:
+            best = None
+            for slot, (seq, stamp) in enumerate(zip(self._seqs, self._stamps)):
+                if seq >= 0 and (best is None or abs(stamp - timestamp) < abs(self._stamps[best] - timestamp)):
+                    best = slot
+            if best is None:
+                return None
+            if best == self._head and read:
+                return self._borrow()
+            self._refs[best] += 1
+            return FrameRef(self, best, self._seqs[best], self._stamps[best])
 
     def read_frame(self):
+        with self.borrow_frame() as ref:
+            return ref.frame.copy()
+
+    def _release(self, slot: int):
         with self._lock:
-            return self.frame.copy()
+            self._refs[slot] -= 1
+            self._frame_read.notify()
 
-    def _read_webcam(self):
-        while True:
+    def _release_deferred(self, slot: int):
+        # Lock free; deque appends are atomic.  Applied by the capture thread
+        self._deferred.append(slot)
+
+    def _apply_deferred(self):
+        # Must be called with self._lock held
+        while self._deferred:
+            self._refs[self._deferred.popleft()] -= 1
+
+    def _free_slot(self) -> Optional[int]:
+        # Must be called with self._lock held
+        self._apply_deferred()
+        n = len(self._refs)
+        for i in range(1, n):
+            slot = (self._head + i) % n
+            if self._refs[slot] == 0:
+                return slot
+        return None
+
+    def _consumed(self) -> bool:
+        # Must be called with self._lock held
+        self._apply_deferred()
+        return self._reads >= getattr(self._src, "consumers", 1) and self._free_slot() is not None
+
+    def _read_frames(self):
+        seq = 0
+        mode = self.shape
+        while self._running and not self._src.finished:
+            with self._lock:
+                if not self._src.realtime:
+                    # Frames are produced on demand, so nothing gets dropped while waiting on the readers
+                    # Deferred releases do not notify, so the condition is checked periodically as well
+                    while not self._frame_read.wait_for(lambda: self._consumed() or not self._running, 0.1):
+                        pass
+                    if not self._running:
+                        break
+                slot = self._free_slot()
+                if slot is not None:
+                    # The frame in the slot ages out; It can no longer be borrowed while it is being overwritten
+                    self.views.evict(self._seqs[slot])
+                    self._seqs[slot] = -1
+            if slot is None:
+                # Every slot is borrowed; drop the frame rather than waiting on the readers
+                with self._cap_lock:
+                    self._src.grab()
+                self.dropped += 1
+                if time.monotonic() - self._drop_logged >= 5.0:
+                    self._drop_logged = time.monotonic()
+                    logging.warning("All frame slots are borrowed, %d frames dropped so far" % self.dropped)
+                continue
+
+            buf = self._slots[slot]
             with self._cap_lock:
-                if self._cap.isOpened():
-                    ret, frame = self._cap.read()
-                else:
-                    raise RuntimeError("Webcam closed unexpectedly")
+                ret, frame, stamp = self._src.read(buf)
             if not ret:
+                if self._src.finished:
+                    break
                 logging.warning("Failed to retrieve frame from video feed")
                 time.sleep(1)
                 continue
+            if not np.may_share_memory(frame, buf):
+                # The camera changed modes and OpenCV allocated a new buffer; Every extension expects the initial mode
+                resizable = frame.shape[2:] == buf.shape[2:]  # Only the resolution changed, not the channels
+                if frame.shape != mode:
+                    mode = frame.shape
+                    if not resizable:
+                        logging.error("The camera changed from %s to %s frames, which can not be converted, dropping "
+                                      "them" % (buf.shape, mode))
+                    elif frame.shape != buf.shape:
+                        logging.warning("The camera changed from %s to %s frames, resizing them" % (buf.shape, mode))
+                if frame.shape == buf.shape:
+                    buf[...] = frame
+                elif resizable:
+                    cv2.resize(frame, (buf.shape[1], buf.shape[0]), dst=buf, interpolation=cv2.INTER_AREA)
+                else:
+                    continue
+
+            seq += 1
+            self._delays.append(time.monotonic() - stamp)
+            if seq > 1:
+                self._intervals.append(stamp - self._stamps[self._head])
             with self._lock:
-                frame = np.resize(frame, self.frame.shape)
-                self.frame[...] = frame[...]
+                self._seqs[slot] = seq
+                self._stamps[slot] = stamp
+                self._reads = 0
+                self._head = slot
+                self._new_frame.notify_all()
+                taps = list(self.taps)
+                for _ in taps:
+                    self._refs[slot] += 1
+            for tap in taps:
+                tap(FrameRef(self, slot, seq, stamp))
+            for listener in list(self.listeners):
+                listener(seq)
+
+        if self._src.finished:
+            logging.info("Frame source finished after %d frames" % seq)
+        with self._lock:
+            self.finished = True
+            self._new_frame.notify_all()
+        for listener in list(self.listeners):
+            listener(None)
 
 
-fmang: Optional[_FrameManager] = None
+fmang: Optional[_FrameManager] = None  # Default source
+sources: Dict[str, _FrameManager] = dict()  # Every source by name, including the default source
 
+DEFAULT = "default"
 
-def start():
+
+def get(source: Optional[str] = None) -> _FrameManager:
+    """
+    Returns the frame manager of a source; None returns the default source
+    """
+    if source is None:
+        return fmang
+    if source not in sources:
+        raise KeyError("Unknown frame source %s, available sources: %s" % (source, ", ".join(sources)))
+    return sources[source]
+
+
+def add_source(name: str, source: FrameSource) -> _FrameManager:
+    """
+    Starts capturing from an additional source; Every source has its own capture thread and frame ring
+    """
+    if name in sources:
+        raise ValueError("Frame source %s already exists" % name)
+    sources[name] = _FrameManager(source)
+    return sources[name]
+
+
+def read_synchronized(names: List[str], after: int = -1,
+                      timeout: Optional[float] = None) -> Optional[Dict[str, FrameRef]]:
+    """
+    Waits for a new frame of the first source, then borrows the frames of the other sources captured closest to it
+
+    Args:
+        names: Sources; The first one paces the reads
+        after: Sequence number of the last frame of the first source processed by the caller
+        timeout: Maximum number of seconds to wait for the frame of the first source
+
+    Returns:
+        Source name -> frame reference; None if the timeout expired
+    """
+    ref = get(names[0]).wait_frame(after, timeout)
+    if ref is None:
+        return None
+    refs = {names[0]: ref}
+    for name in names[1:]:
+        other = get(name).borrow_closest(ref.timestamp)
+        if other is None:
+            for r in refs.values():
+                r.release()
+            return None
+        refs[name] = other
+    return refs
+
+
+def start(source: Optional[FrameSource] = None):
     global fmang
-    fmang = _FrameManager()
+    fmang = add_source(DEFAULT, source if source is not None else WebcamSource())
     logging.basicConfig(level=logging.INFO)
+
+
+def stop():
+    global fmang
+    for mang in sources.values():
+        mang.close()
+    sources.clear()
+    fmang = None
@@ -0,0 +1,329 @@
+import os
+import time
+import logging
+from threading import Thread, Lock, Condition
+from typing import Optional, Dict, List
+
+import cv2
+import numpy as np
+
+import impl
+import models
+import metrics
+import governor
+
+
+#
+# This file contains the logic for computing facial landmarks once per frame on behalf of every extension
+#
+# The service is started by the first extension asking for landmarks, and runs on its own thread.  It detects faces with
+# the dlib HOG detector on a downscaled grayscale view of each frame, and predicts the 68 landmarks of every face.  Face
+# rectangles are reused for a few frames in between full detections, following the landmarks of the face.  Results are
+# published in the pixel coordinates of the full frame, whatever resolution the service runs at.
+#
+# The service does not ship a landmark model.  Extensions asking for landmarks register the 68 point dlib model they
+# bundle with register_predictor, and the first one registered is shared by all of them.
+#
+
+predictor_path: Optional[str] = None
+width = 500  # Width of the frames the faces are detected in, before scaling by the governor
+
+
+class Landmarks:
+    """
+    Faces found in a single frame
+    """
+    def __init__(self, seq: int, timestamp: float, rects: np.ndarray, points: np.ndarray):
+        self.seq = seq
+        self.timestamp = timestamp
+        self.rects = rects  # [n, 4] int (left, top, right, bottom)
+        self.points = points  # [n, 68, 2] float32 (x, y)
+
+    def __len__(self):
+        return len(self.rects)
+
+
+class FaceTracker:
+    """
+    Finds the faces of consecutive frames, reusing the rectangles of the previous frame in between full frame detections
+    and shifting them by the motion of the landmarks of each face; Shared by the landmark service and extensions running
+    their own models.  Not thread safe, as the dlib face detector is not.
+
+    Example:
+        for f, rect in enumerate(tracker.detect(gray)):
+            points = predict(gray, rect)
+            if tracker.follow(f, rect, points.mean(axis=0)) is None:
+                continue  # Lost track of the face
+        tracker.end_frame()
+    """
+    def __init__(self, detector, track: bool = True, redetect: int = 10, roi_pad: Optional[float] = None):
+        """
+        Args:
+            detector: dlib face detector
+            track: Reuse the face rectangles of the previous frame instead of running the detector on every frame
+            redetect: When tracking, the number of frames between full frame detections
+            roi_pad: When tracking, run the detector only inside the previous face rectangles padded by this fraction
+                of their size, instead of reusing the rectangles as is
+        """
+        import dlib
+        self._rectangle = dlib.rectangle
+        self.detector = detector
+        self.track = track
+        self.redetect = redetect
+        self.roi_pad = roi_pad
+        self._rects = list()
+        self._centers = list()
+        self._since_detect = 0
+        self._shape = None
+        self._reused = False
+        self._tracked = list()
+        self._tracked_centers = list()
+        self._lost = False
+
+    def _search_roi(self, gray: np.ndarray) -> List:
+        h, w = gray.shape
+        rects = list()
+        for rect in self._rects:
+            px = int(self.roi_pad * rect.width())
+            py = int(self.roi_pad * rect.height())
+            left, top = max(rect.left() - px, 0), max(rect.top() - py, 0)
+            right, bottom = min(rect.right() + px, w), min(rect.bottom() + py, h)
+            if right <= left or bottom <= top:
+                continue
+            for r in self.detector(gray[top:bottom, left:right], 1):
+                rects.append(self._rectangle(r.left() + left, r.top() + top, r.right() + left, r.bottom() + top))
+        return rects
+
+    def _find(self, gray: np.ndarray) -> List:
+        if gray.shape != self._shape:
+            self._rects = list()  # The frame size changed, so the rectangles are no longer valid
+            self._shape = gray.shape
+        if self.track and self._rects and self._since_detect < self.redetect:
+            self._since_detect += 1
+            if self.roi_pad is None:
+                self._reused = True
+                return self._rects
+            rects = self._search_roi(gray)
+            if rects:
+                return rects
+        # Full frame detection; Always used when not tracking, periodically while tracking, or on tracking loss
+        self._since_detect = 0
+        return self.detector(gray, 1)
+
+    def detect(self, gray: np.ndarray) -> List:
+        """
+        Returns the dlib rectangles of the faces in a grayscale frame; Every face must then be passed to follow, and
+        the frame finished with end_frame
+        """
+        self._reused = False
+        self._tracked = list()
+        self._tracked_centers = list()
+        self._lost = False
+        return self._find(gray)
+
+    def follow(self, f: int, rect, center):
+        """
+        Records the landmarks of a face returned by detect
+
+        Args:
+            f: Index of the face in the list returned by detect
+            rect: Its rectangle
+            center: Mean (x, y) of the landmarks of the face followed between frames
+
+        Returns:
+            The rectangle of the face, shifted by the motion of the landmarks when it was reused from the previous
+            frame; None if the landmarks left the reused rectangle, in which case they are not trusted
+        """
+        if not self.track:
+            return rect
+        if self._reused:
+            cx, cy = center
+            if not (rect.left() <= cx <= rect.right() and rect.top() <= cy <= rect.bottom()):
+                self._lost = True
+                return None
+            dx, dy = int(round(cx - self._centers[f][0])), int(round(cy - self._centers[f][1]))
+            rect = self._rectangle(rect.left() + dx, rect.top() + dy, rect.right() + dx, rect.bottom() + dy)
+        self._tracked.append(rect)
+        self._tracked_centers.append(center)
+        return rect
+
+    def end_frame(self):
+        """
+        Keeps the faces of the frame for the next one
+        """
+        if not self.track:
+            return
+        if self._lost:
+            self._since_detect = self.redetect  # Forcing a full detection on the next frame
+        self._rects = self._tracked
+        self._centers = self._tracked_centers
+
+
+def _load_detector():
+    import dlib
+    return dlib.get_frontal_face_detector()
+
+
+def _load_predictor():
+    import dlib
+    if predictor_path is None:
+        raise RuntimeError("No landmark model is registered; Call ibs.API.register_landmark_model first")
+    return dlib.shape_predictor(predictor_path)
+
+
+def _models():
+    # dlib face detectors keep scratch buffers, so every thread gets its own; The predictor is shared
+    return (models.get("dlib.get_frontal_face_detector", _load_detector, thread_safe=False),
+            models.get(predictor_path, _load_predictor, resident=True))
+
+
+class _LandmarkService:  # Singleton
+    def __init__(self, redetect: int = 10):
+        """
+        Args:
+            redetect: Number of frames between full frame face detections
+        """
+        self.redetect = redetect
+        # Every frame is processed, so only the resolution is lowered
+        self.governor = governor.Governor(max_stride=1, name="landmarks")
+        # Reported like an extension, as it is where the extensions asking for landmarks spend their time
+        self.metrics = metrics.get("landmarks")
+        self.metrics.governor = self.governor
+        self._cond = Condition()
+        self._latest: Optional[Landmarks] = None
+        self._subscribers: Dict[str, int] = dict()  # Extension name -> sequence number of the last result it received
+        self._finished = False
+        self._tracker: Optional[FaceTracker] = None
+
+        self._running = True
+        self._th = Thread(target=self._run, daemon=True)
+        self._th.start()
+
+    def _process(self, ref: impl.FrameRef) -> Landmarks:
+        hog, predictor = _models()
+        if self._tracker is None:
+            self._tracker = FaceTracker(hog, redetect=self.redetect)
+        gray = ref.view(width=self.governor.scaled(width), color=cv2.COLOR_BGR2GRAY)
+        scale = ref.frame.shape[1] / gray.shape[1]
+
+        rects = self._tracker.detect(gray)
+        out_rects = np.empty((len(rects), 4), dtype=int)
+        out_points = np.empty((len(rects), 68, 2), dtype=np.float32)
+        n = 0
+        for f, rect in enumerate(rects):
+            shape = predictor(gray, rect)
+            points = out_points[n]
+            for j, p in enumerate(shape.parts()):
+                points[j] = p.x, p.y
+            rect = self._tracker.follow(f, rect, points.mean(axis=0))
+            if rect is None:
+                continue
+            out_rects[n] = rect.left(), rect.top(), rect.right(), rect.bottom()
+            n += 1
+        self._tracker.end_frame()
+        return Landmarks(ref.seq, ref.timestamp, (out_rects[:n] * scale).astype(int), out_points[:n] * scale)
+
+    def _run(self):
+        seq = -1
+        while self._running:
+            if not impl.fmang.realtime:
+                # Frames are produced on demand, so every subscriber gets every result
+                with self._cond:
+                    self._cond.wait_for(
+                        lambda: not self._running or all(s >= seq for s in self._subscribers.values()))
+            self.metrics.on_wait(time.monotonic())
+            ref = impl.fmang.wait_frame(seq, timeout=0.5)
+            if ref is None:
+                if impl.fmang.finished:
+                    break
+                continue
+            start = time.monotonic()
+            self.metrics.on_frame(ref.seq, ref.timestamp, start)
+            with ref:
+                try:
+                    result = self._process(ref)
+                except Exception as e:
+                    logging.error("Landmark service failed: %s" % e)
+                    break
+            seq = result.seq
+            if impl.fmang.realtime:
+                self.governor.observe(time.monotonic() - start)
+            with self._cond:
+                self._latest = result
+                self._cond.notify_all()
+        with self._cond:
+            self._finished = True
+            self._cond.notify_all()
+
+    def wait(self, name: str, after: int = -1, timeout: Optional[float] = None) -> Optional[Landmarks]:
+        with self._cond:
+            self._subscribers.setdefault(name, after)
+            if not self._cond.wait_for(
+                    lambda: (self._latest is not None and self._latest.seq > after) or self._finished, timeout):
+                return None
+            if self._latest is None or self._latest.seq <= after:
+                return None  # The frame source has no more frames
+            self._subscribers[name] = self._latest.seq
+            self._cond.notify_all()
+            return self._latest
+
+    @property
+    def finished(self) -> bool:
+        return self._finished
+
+    def close(self):
+        self._running = False
+        with self._cond:
+            self._cond.notify_all()
+        self._th.join()
+
+
+service: Optional[_LandmarkService] = None
+_lock = Lock()
+
+
+def register_predictor(path: str):
+    """
+    Sets the 68 point dlib landmark model of the service; Only the first model registered is used
+    """
+    global predictor_path
+    with _lock:
+        if predictor_path is None:
+            predictor_path = path
+        elif os.path.abspath(path) != os.path.abspath(predictor_path):
+            logging.warning("Landmark model %s is already registered, ignoring %s" % (predictor_path, path))
+
+
+def wait(name: str, after: int = -1, timeout: Optional[float] = None) -> Optional[Landmarks]:
+    global service
+    with _lock:
+        if service is None:
+            service = _LandmarkService()
+    return service.wait(name, after, timeout)
+
+
+def finished() -> bool:
+    """
+    Whether the landmark service has stopped for good, because the frame source has no more frames; Once finished, wait
+    returns None without blocking
+    """
+    return service is not None and service.finished
+
+
+def preload():
+    """
+    Loads the landmark predictor and runs it once on a blank frame; The face detector is cheap to load, and is only
+    created by the service thread, as every thread gets its own
+    """
+    import dlib
+    predictor = models.get(predictor_path, _load_predictor, resident=True)
+    gray = np.zeros((375, width), dtype=np.uint8)
+    predictor(gray, dlib.rectangle(0, 0, width // 2, 375 // 2))
+
+
+def stop():
+    global service
+    with _lock:
+        if service is not None:
+            service.close()
+            service = None
@@ -1,7 +1,13 @@
 import os
 import sys
+import time
+import json
+import logging
+import argparse
 import importlib
 from threading import Thread
+import concurrent.futures
+from concurrent.futures import Future, ThreadPoolExecutor
 from typing import Optional, Type, Dict, Tuple, List
 
 from PyQt5 import QtGui
@@ -12,17 +18,44 @@ from PyQt5.QtWidgets import QMessageBox
 from PyQt5.QtWidgets import QPushButton
 from PyQt5.QtWidgets import QCheckBox
 from PyQt5.QtWidgets import QLabel
+from PyQt5.QtWidgets import QProgressDialog
 from PyQt5.QtWidgets import QWidget
 from PyQt5.QtWidgets import QVBoxLayout, QHBoxLayout
 
 import ibs
+import aio
 import impl
 import config
+import extproc
+import models
+import metrics
+import landmarks
+import recorder
+import serialization
 from layout import build_layout
 
 
+class MetricsOverlay(QLabel):
+    """
+    Semi-transparent overlay showing the live per-extension metrics
+    """
+    def __init__(self, parent: QWidget, interval: float = 1.0):
+        super(MetricsOverlay, self).__init__(parent)
+        self.setStyleSheet("background-color: rgba(0, 0, 0, 160); color: white; padding: 4px;")
+        self.setAttribute(Qt.WA_TransparentForMouseEvents)
+
+        self.timer = QtCore.QTimer(self)
+        self.timer.timeout.connect(self.refresh)
+        self.timer.start(int(1000 * interval))
+
+    def refresh(self):
+        self.setText(metrics.format_snapshot(metrics.snapshot()))
+        self.adjustSize()
+        self.raise_()
+
+
 class MainWindow(QWidget):
-    def __init__(self, exts: List[ibs.IbsExt]):
+    def __init__(self, exts: List[ibs.IbsExt], show_metrics: bool = False):
         super(MainWindow, self).__init__(flags=Qt.WindowFlags())
         self.setCursor(Qt.ArrowCursor)
         self.setWindowIcon(QtGui.QIcon("assets/HSL-logo.png"))
@@ -31,7 +64,7 @@ class MainWindow(QWidget):
         self.exts = exts
         gui_info: List[Optional[Tuple[QWidget, ibs.LayoutHint]]] = list()
         for e in self.exts:
-            guicfg = e.get_guicfg()
+            guicfg = e.get_guicfg() if not e.run_in_process() else None
             if guicfg:
                 layout = guicfg.get_layout()
                 widget = guicfg.get_widget()
@@ -40,17 +73,46 @@ class MainWindow(QWidget):
                 gui_info.append(None)
         self.setLayout(build_layout(gui_info))
         self.ext_ths = list()
+        self.ext_procs = list()
+        self.ext_tasks = list()
         for e, info in zip(self.exts, gui_info):
-            th = Thread(target=e.startup_ref(), args=(ibs.API(e.get_name()), info[0] if info else None))
+            startup = e.startup_ref()
+            if aio.is_async(startup):
+                if e.run_in_process():
+                    logging.warning("%s is an asyncio extension, running it in the main process" % e.get_name())
+                self.ext_tasks.append(aio.run(startup(aio.AsyncAPI(e.get_name()), info[0] if info else None)))
+                continue
+            if e.run_in_process():
+                proc = extproc.ExtProcess(e, ibs.API(e.get_name()))
+                metrics.queue_sources["process/%s" % e.get_name()] = lambda p=proc: p.pending
+                self.ext_procs.append(proc)
+                continue
+            th = Thread(target=startup, args=(ibs.API(e.get_name()), info[0] if info else None))
             th.start()
             self.ext_ths.append(th)
 
-    def shutdown(self):
+        self.metrics_overlay = MetricsOverlay(self) if show_metrics else None
+
+    def shutdown(self, timeout: float = 5.0):
         # Application shutdown
         for e in self.exts:
-            e.shutdown_ref()()  # Calling from the main thread
+            shutdown = e.shutdown_ref()
+            if aio.is_async(shutdown):
+                aio.run(shutdown()).result(timeout)
+            elif not e.run_in_process() or aio.is_async(e.startup_ref()):
+                shutdown()  # Calling from the main thread
+        for proc in self.ext_procs:
+            proc.stop()
         for th in self.ext_ths:
             th.join()
+        for task in self.ext_tasks:
+            try:
+                task.result(timeout)
+            except concurrent.futures.TimeoutError:
+                logging.warning("An asyncio extension did not shut down, cancelling it")
+                task.cancel()
+            except Exception:
+                pass  # Already logged
 
 
 def invalid_extensions(app):
@@ -164,18 +226,21 @@ class ToggleExpandable(QWidget):
 
 class StartupWindow(QWidget):
     # noinspection PyArgumentList, PyUnresolvedReferences
-    def __init__(self, extmap: Dict[Type[ibs.IbsExt], Optional[Type[ibs.IbsOpt]]], exts: List[ibs.IbsExt]):
+    def __init__(self, manifests: List["ExtManifest"], exts: List[ibs.IbsExt]):
         super(StartupWindow, self).__init__(flags=Qt.WindowFlags())
         self.continued = False
 
         self.exts = exts
-        self.extmap: Dict[Type[ibs.IbsExt], Tuple[ToggleExpandable, Optional[ibs.IbsOpt]]] = dict()
+        self.extmap: Dict[str, Tuple[ExtManifest, ToggleExpandable, Optional[ibs.IbsOpt]]] = dict()
+        self.pool = ThreadPoolExecutor(max_workers=os.cpu_count() or 4, thread_name_prefix="preload")
+        self.preloads: Dict[str, Future] = dict()  # Package -> preload of the extension, once it has been selected
         te_layout = QVBoxLayout()
-        for ext in extmap:
-            name = ext.get_name()
-            opt = extmap[ext]() if extmap[ext] else None
-            extopt = ToggleExpandable(name, opt)
-            self.extmap[ext] = (extopt, opt)
+        for manifest in manifests:
+            opt_cls = manifest.load_options()
+            opt = opt_cls() if opt_cls else None
+            extopt = ToggleExpandable(manifest.name, opt)
+            extopt.check_box.toggled.connect(lambda checked, m=manifest: checked and self.preload(m))
+            self.extmap[manifest.package] = (manifest, extopt, opt)
             te_layout.addWidget(extopt)
         te_layout.setAlignment(QtCore.Qt.AlignTop)
         te_widget = QWidget()
@@ -188,10 +253,26 @@ class StartupWindow(QWidget):
         layout.addWidget(continue_button)
         self.setLayout(layout)
 
+    @staticmethod
+    def _preload(manifest: "ExtManifest"):
+        start = time.monotonic()
+        manifest.load().preload()
+        logging.info("Preloaded %s in %.1f s" % (manifest.name, time.monotonic() - start))
+
+    def preload(self, manifest: "ExtManifest"):
+        # Importing the extension and loading its models while the user is still choosing options
+        if manifest.package not in self.preloads:
+            self.preloads[manifest.package] = self.pool.submit(self._preload, manifest)
+
     def on_continue(self):
-        for ext in self.extmap:
-            if self.extmap[ext][0].check_box.isChecked():
-                self.exts.append(ext(self.extmap[ext][1].get_config() if self.extmap[ext][1] else None))
+        # The extension packages are only imported once they have been chosen
+        chosen = dict()
+        for manifest, extopt, opt in self.extmap.values():
+            if extopt.check_box.isChecked():
+                self.preload(manifest)
+                self.exts.append(manifest.load()(opt.get_config() if opt else None))
+                chosen[manifest.name] = self.preloads[manifest.package]
+        self.preloads = chosen
         self.continued = True
         self.close()
 
@@ -202,45 +283,170 @@ class StartupWindow(QWidget):
             sys.exit(0)
 
 
-def main():
-    impl.start()
-    app = QApplication(sys.argv)
-
-    # Loading extensions
+class ExtManifest:
+    """
+    Describes an extension without importing it; Read from the manifest.json file of the extension package:
+
+        {"name": "Blink Detection", "options": "options:Options"}
+
+    The options entry (module:class, relative to the package) is optional, and its module should only import what the
+    options widget needs.  Packages without a manifest are imported during discovery.
+    """
+    def __init__(self, package: str, name: str, options: Optional[str] = None):
+        self.package = package
+        self.name = name
+        self.options = options
+        self._ext: Optional[Type[ibs.IbsExt]] = None
+        self._opt: Optional[Type[ibs.IbsOpt]] = None
+
+    @staticmethod
+    def from_module(package: str, module) -> "ExtManifest":
+        manifest = ExtManifest(package, module.Extension.get_name())
+        manifest._ext = module.Extension
+        manifest._opt = getattr(module, "Options", None)
+        return manifest
+
+    def _import(self, module: str):
+        config.current_ext = self.package
+        return importlib.import_module(module)
+
+    def load_options(self) -> Optional[Type[ibs.IbsOpt]]:
+        if self._opt is None and self.options:
+            module, cls = self.options.split(":")
+            self._opt = getattr(self._import("extensions.%s.%s" % (self.package, module)), cls)
+        return self._opt
+
+    def load(self) -> Type[ibs.IbsExt]:
+        if self._ext is None:
+            self._ext = self._import("extensions.%s" % self.package).Extension
+        return self._ext
+
+
+def wait_for_preloads(preloads: Dict[str, Future], interval: float = 0.05):
+    """
+    Shows the progress of the model preloads until all of them have finished
+    """
+    if all(f.done() for f in preloads.values()):
+        return
+    dialog = QProgressDialog("Loading models", None, 0, len(preloads))
+    dialog.setWindowTitle("HSL | Biometric Software")
+    dialog.setWindowIcon(QtGui.QIcon("assets/HSL-logo.png"))
+    dialog.setMinimumDuration(0)
+    loop = QtCore.QEventLoop()
+
+    def poll():
+        pending = [name for name, f in preloads.items() if not f.done()]
+        dialog.setValue(len(preloads) - len(pending))
+        dialog.setLabelText("Loading models: %s" % ", ".join(pending))
+        if not pending:
+            loop.quit()
+
+    timer = QtCore.QTimer()
+    timer.timeout.connect(poll)
+    timer.start(int(1000 * interval))
+    poll()
+    loop.exec_()
+    timer.stop()
+    dialog.close()
+
+    for name, f in preloads.items():
+        if f.exception() is not None:
+            # The extension will load its models itself on startup
+            logging.error("Failed to preload %s: %s" % (name, f.exception()))
+
+
+def discover_extensions() -> List[ExtManifest]:
+    """
+    Finds every extension in the extensions directory; Only extensions without a manifest.json are imported
+
+    Returns:
+        Manifests of the extensions
+    """
+    manifests = list()
     if not os.path.isdir("extensions") or not os.path.isfile("extensions/__init__.py"):
-        invalid_extensions(app)
+        return manifests
 
     exts = os.listdir("extensions")
-    exts = [e for e in exts if e != "__init__.py"]
-    if len(exts) == 0:
-        invalid_extensions(app)
+    exts = [e for e in exts if e != "__init__.py" and e != "__pycache__"]
+    for e in sorted(exts):
+        manifest_path = os.path.join("extensions", e, "manifest.json")
+        if os.path.isfile(manifest_path):
+            with open(manifest_path) as f:
+                info = json.load(f)
+            manifests.append(ExtManifest(e, info["name"], info.get("options")))
+            continue
 
-    extmap = dict()
-    for e in exts:
         if e.endswith(".py"):
             e = e[:-3]
         config.current_ext = e
         module = importlib.import_module("extensions.%s" % e)
         if not hasattr(module, "Extension"):
             continue
-        if hasattr(module, "Options"):
-            extmap[module.Extension] = module.Options
-            continue
-        extmap[module.Extension] = None
+        manifests.append(ExtManifest.from_module(e, module))
+    return manifests
+
+
+def main():
+    parser = argparse.ArgumentParser(description="HSL Biometric Software")
+    parser.add_argument("--replay", metavar="PATH", help="replay a recorded video, .npy frame array or image directory")
+    parser.add_argument("--fast", action="store_true", help="replay as fast as the extensions consume frames")
+    parser.add_argument("--source", metavar="NAME=DEVICE", action="append", default=list(),
+                        help="additional frame source, a camera index or a recording to replay (eg. eye=1)")
+    parser.add_argument("--low-latency", action="store_true",
+                        help="keep the camera buffers drained, so frames are never stale (at some cost in frame rate)")
+    parser.add_argument("--output", metavar="PATH", help="session file to record extension data to",
+                        default=time.strftime("data/session-%Y%m%d-%H%M%S.ibsr"))
+    parser.add_argument("--record-frames", action="store_true",
+                        help="record the raw camera frames next to the session file")
+    parser.add_argument("--codec", default="FFV1", help="fourcc of the frame recording codec (default: FFV1, lossless)")
+    parser.add_argument("--metrics", action="store_true", help="show live per-extension metrics")
+    parser.add_argument("--metrics-out", metavar="PATH", help="dump per-extension metrics to a json file on exit")
+    args, qt_args = parser.parse_known_args()
+
+    logging.basicConfig(level=logging.INFO)
+    app = QApplication(sys.argv[:1] + qt_args)
+
+    # Loading extensions
+    manifests = discover_extensions()
+    if len(manifests) == 0:
+        invalid_extensions(app)
 
     # Configuring extensions
     exts = list()  # This will get initialized by the startup window
-    window = StartupWindow(extmap, exts)
+    window = StartupWindow(manifests, exts)
     window.show()
     e_code = app.exec_()
     if e_code != 0:
         sys.exit(e_code)
-
-    # Launching extensions
-    window = MainWindow(exts)
+    wait_for_preloads(window.preloads)
+    window.pool.shutdown(wait=False)
+
+    # Launching extensions; The camera is only opened once the extensions have been chosen
+    capture = impl.CaptureConfig.union([e.get_capture_config() for e in exts])
+    # Replaying as fast as possible holds each frame until every extension reading the default source has borrowed it
+    consumers = max(len({reader for e in exts for reader in e.get_frame_readers()}), 1)
+    impl.start(impl.ReplaySource(args.replay, realtime=not args.fast, consumers=consumers) if args.replay else
+               impl.WebcamSource(config=capture, low_latency=args.low_latency))
+    for spec in args.source:
+        name, device = spec.split("=", 1)
+        impl.add_source(name, impl.WebcamSource(int(device), capture, args.low_latency) if device.isdigit() else
+                        impl.ReplaySource(device, realtime=not args.fast))
+    serialization.start(args.output)
+    if args.record_frames:
+        recorder.start(os.path.splitext(args.output)[0] + ".mkv", args.codec)
+    window = MainWindow(exts, args.metrics)
     window.show()
     e_code = app.exec_()
     window.shutdown()
+    aio.stop()
+    landmarks.stop()
+    models.end_session()
+    if args.metrics_out:
+        metrics.dump(args.metrics_out)
+    recorder.stop()
+    impl.stop()
+    serialization.stop()
+    serialization.compact(args.output)
     sys.exit(e_code)
 
 
@@ -0,0 +1,171 @@
+import json
+import math
+import time
+from threading import Lock
+from typing import Dict, Callable, Optional
+
+import impl
+import models
+import serialization
+
+
+#
+# This file contains the logic for measuring the per-extension performance of the framework
+#
+
+
+class Histogram:
+    """
+    Histogram of durations in seconds with logarithmic buckets from 1us to 10s (10 buckets per decade)
+    """
+    decades = 7
+    per_decade = 10
+    smallest = 1e-6
+
+    def __init__(self):
+        self.counts = [0] * (self.decades * self.per_decade + 2)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, value: float):
+        if value <= self.smallest:
+            idx = 0
+        else:
+            idx = min(int(math.log10(value / self.smallest) * self.per_decade) + 1, len(self.counts) - 1)
+        self.counts[idx] += 1
+        self.count += 1
+        self.total += value
+        self.max = max(self.max, value)
+
+    def percentile(self, p: float) -> float:
+        """
+        Returns the upper bound of the bucket containing the p-th percentile (0 < p <= 100)
+        """
+        if self.count == 0:
+            return 0.0
+        target = self.count * p / 100
+        seen = 0
+        for idx, n in enumerate(self.counts):
+            seen += n
+            if seen >= target:
+                return min(self.smallest * 10 ** (idx / self.per_decade), self.max)
+        return self.max
+
+    @property
+    def mean(self) -> float:
+        return self.total / self.count if self.count else 0.0
+
+    def summary(self) -> dict:
+        return {
+            "count": self.count,
+            "mean": self.mean,
+            "p50": self.percentile(50),
+            "p90": self.percentile(90),
+            "p99": self.percentile(99),
+            "max": self.max,
+        }
+
+
+class ExtMetrics:
+    """
+    Frame processing metrics of a single extension, updated by the extension's API
+    """
+    def __init__(self):
+        self._lock = Lock()
+        self.processing = Histogram()  # Time from receiving a frame to asking for the next one
+        self.latency = Histogram()  # Time from capturing a frame to asking for the next one
+        self.staleness = Histogram()  # Age of frames when they are received
+        self.frames = 0
+        self.dropped = 0
+        self._last_seq: Optional[int] = None
+        self._last_stamp = 0.0
+        self._received = 0.0
+        self.governor = None
+
+    def on_wait(self, now: float) -> Optional[float]:
+        """
+        Returns:
+            Processing time of the previous frame, if any
+        """
+        with self._lock:
+            if self._last_seq is not None and self._received:
+                processing = now - self._received
+                self.processing.add(processing)
+                self.latency.add(now - self._last_stamp)
+                self._received = 0.0
+                return processing
+        return None
+
+    def on_frame(self, seq: int, stamp: float, now: float):
+        with self._lock:
+            if self._last_seq is not None and seq > self._last_seq + 1:
+                self.dropped += seq - self._last_seq - 1
+            self.frames += 1
+            self.staleness.add(now - stamp)
+            self._last_seq = seq
+            self._last_stamp = stamp
+            self._received = now
+
+    def summary(self) -> dict:
+        with self._lock:
+            return {
+                "frames": self.frames,
+                "dropped": self.dropped,
+                "processing": self.processing.summary(),
+                "latency": self.latency.summary(),
+                "staleness": self.staleness.summary(),
+                "governor": self.governor.summary() if self.governor is not None else None,
+            }
+
+
+extensions: Dict[str, ExtMetrics] = dict()
+queue_sources: Dict[str, Callable[[], int]] = dict()  # Name -> function returning the current queue depth
+counters: Dict[str, Callable[[], int]] = dict()  # Name -> function returning the current count
+_lock = Lock()
+
+
+def get(ext: str) -> ExtMetrics:
+    with _lock:
+        if ext not in extensions:
+            extensions[ext] = ExtMetrics()
+        return extensions[ext]
+
+
+def snapshot() -> dict:
+    queues = {name: depth() for name, depth in list(queue_sources.items())}
+    if serialization.writer is not None:
+        queues.update({"serialization/%s" % name: n for name, n in serialization.writer.queue_depths().items()})
+    return {
+        "time": time.monotonic(),
+        "camera_fps": impl.fmang.fps if impl.fmang is not None else 0.0,
+        "sources": {name: dict(mang.capture_stats(), fps=mang.fps, dropped=mang.dropped)
+                    for name, mang in list(impl.sources.items())},
+        "extensions": {name: m.summary() for name, m in list(extensions.items())},
+        "queues": queues,
+        "counters": {name: count() for name, count in list(counters.items())},
+        "models": models.loaded(),
+    }
+
+
+def format_snapshot(snap: dict) -> str:
+    lines = ["Camera: %.1f fps" % snap["camera_fps"]]
+    for name, stats in snap["sources"].items():
+        lines.append("Source %s: %.1f fps, jitter %.1f ms, delay %.1f ms, %d dropped" % (
+            name, stats["fps"], 1000 * stats["jitter"], 1000 * stats["delay"], stats["dropped"]))
+    for name, m in snap["extensions"].items():
+        lines.append("%s: %d frames, %d dropped, processing p50 %.1f ms p99 %.1f ms, latency p50 %.1f ms" % (
+            name, m["frames"], m["dropped"], 1000 * m["processing"]["p50"], 1000 * m["processing"]["p99"],
+            1000 * m["latency"]["p50"]))
+    for name, n in snap["queues"].items():
+        lines.append("%s: %d queued" % (name, n))
+    for name, n in snap["counters"].items():
+        lines.append("%s: %d" % (name, n))
+    if snap["models"]:
+        lines.append("Models: %s" % ", ".join(snap["models"]))
+    return "\n".join(lines)
+
+
+def dump(path: str):
+    with open(path, "w") as f:
+        json.dump(snapshot(), f, indent=2)
@@ -0,0 +1,84 @@
+import time
+import logging
+from threading import Lock, local
+from typing import Callable, Dict, Any, List
+
+
+#
+# This file contains the logic for sharing loaded models between extensions
+#
+# Models are identified by a key, usually the path of the model file, so extensions loading the same file share a single
+# instance.  Models which can not be called from several threads at once are instantiated once per thread instead.
+# Models are dropped at the end of a session unless they are resident, in which case they are reused by the next
+# session of the same process.
+#
+
+
+class _Entry:
+    def __init__(self, loader: Callable[[], Any], thread_safe: bool, resident: bool):
+        self.loader = loader
+        self.thread_safe = thread_safe
+        self.resident = resident
+        self.lock = Lock()
+        self.instance = None
+        self.local = local()
+        self.loads = 0
+
+    def _load(self, key: str):
+        start = time.monotonic()
+        instance = self.loader()
+        self.loads += 1
+        logging.info("Loaded model %s in %.2f s" % (key, time.monotonic() - start))
+        return instance
+
+    def get(self, key: str):
+        if not self.thread_safe:
+            # Only the calling thread uses its instance, so no locking is needed
+            if not hasattr(self.local, "instance"):
+                self.local.instance = self._load(key)
+            return self.local.instance
+        with self.lock:  # Other threads asking for the model wait for the first load instead of loading it again
+            if self.instance is None:
+                self.instance = self._load(key)
+            return self.instance
+
+
+_entries: Dict[str, _Entry] = dict()
+_lock = Lock()
+
+
+def get(key: str, loader: Callable[[], Any], thread_safe: bool = True, resident: bool = False):
+    """
+    Returns the model registered under the key, loading it on first use
+
+    Args:
+        key: Identifier of the model, usually the path of the model file
+        loader: Function loading the model; Only called if the model is not loaded yet
+        thread_safe: Whether the model may be called from several threads at once; Otherwise every thread gets its own
+            instance
+        resident: Keep the model loaded between sessions
+    """
+    with _lock:
+        entry = _entries.get(key)
+        if entry is None:
+            entry = _entries[key] = _Entry(loader, thread_safe, resident)
+        entry.resident = entry.resident or resident
+    return entry.get(key)
+
+
+def loaded() -> List[str]:
+    """
+    Keys of the models loaded at least once in this session, or kept resident from a previous one; Reported in the
+    metrics
+    """
+    with _lock:
+        return [key for key, entry in _entries.items() if entry.loads]
+
+
+def end_session():
+    """
+    Drops every model which is not resident; Per-thread instances are dropped along with their threads
+    """
+    with _lock:
+        for key in [key for key, entry in _entries.items() if not entry.resident]:
+            del _entries[key]
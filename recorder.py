@@ -0,0 +1,197 @@
+import os
+import sys
+import struct
+import logging
+import multiprocessing as mp
+from threading import Thread, Lock
+from multiprocessing.shared_memory import SharedMemory
+from typing import Optional, Dict
+
+import cv2
+import numpy as np
+
+import impl
+import metrics
+
+
+#
+# This file contains the logic for recording the raw camera frames of a session
+#
+# The capture thread hands every new frame to the recorder through a tap of impl._FrameManager.  The recorder keeps the
+# frame slot borrowed and passes its number to a worker process, which reads the frame from the shared memory ring and
+# encodes it, so neither copying nor encoding happens on the capture thread.  At most max_pending frames are borrowed by
+# the recorder; Further frames are dropped and counted instead of holding up the capture.
+#
+# Next to the video, an index file holds the sequence number and capture time of every encoded frame:
+#   header:  magic (4 bytes) | version (u16)
+#   records: sequence number (i64) | timestamp in ns on the time.monotonic clock (i64)
+# Record i describes frame i of the video, so the index can be memory mapped and searched without decoding the video.
+#
+
+MAGIC = b"IBSV"
+VERSION = 1
+
+header_fmt = struct.Struct("<4sH")
+index_dtype = np.dtype([("seq", "<i8"), ("timestamp", "<i8")])
+
+
+def _encode_main(ring, path: str, fourcc: str, fps: float, frames, done):
+    shm_name, shape, dtype = ring
+    shm = SharedMemory(name=shm_name)
+    slots = np.ndarray(shape, dtype=np.dtype(dtype), buffer=shm.buf)
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*fourcc), fps, (shape[2], shape[1]))
+    if not writer.isOpened():
+        logging.error("Unable to open %s for recording with the %s codec" % (path, fourcc))
+    done.put("ready")
+    with open(os.path.splitext(path)[0] + ".idx", "wb") as index:
+        index.write(header_fmt.pack(MAGIC, VERSION))
+        while True:
+            msg = frames.get()
+            if msg is None:
+                break
+            slot, seq, stamp = msg
+            ok = writer.isOpened()
+            if ok:
+                writer.write(slots[slot])
+                index.write(np.array([(seq, int(stamp * 1e9))], dtype=index_dtype).tobytes())
+            done.put((seq, ok))
+    writer.release()
+    del slots
+    shm.close()
+    done.put(None)
+
+
+class _Recorder:  # Singleton
+    def __init__(self, path: str, fourcc: str = "FFV1", fps: Optional[float] = None, max_pending: int = 4):
+        """
+        Args:
+            path: Video file; The index is written next to it with the .idx extension
+            fourcc: Codec of the video; FFV1 is lossless, MJPG is smaller and cheaper to encode
+            fps: Nominal frame rate written to the video; Defaults to the measured camera frame rate.  The index holds
+                the actual capture times
+            max_pending: Maximum number of frames waiting to be encoded; Must be less than the number of frame slots
+        """
+        if fps is None:
+            fps = impl.fmang.fps or 30.0
+        ctx = mp.get_context("spawn")
+        self.path = path
+        self.max_pending = max_pending
+        self.recorded = 0
+        self.dropped = 0
+        self._pending: Dict[int, impl.FrameRef] = dict()
+        self._lock = Lock()
+        self._frames = ctx.Queue()
+        self._done = ctx.Queue()
+        self._proc = ctx.Process(
+            target=_encode_main,
+            args=(impl.fmang.shared_ring, path, fourcc, fps, self._frames, self._done),
+            daemon=True
+        )
+        self._proc.start()
+        # Frames are only handed over once the encoder is up, so the start of the process does not count as drops
+        if self._done.get(timeout=30.0) != "ready":
+            raise RuntimeError("Recorder process failed to start")
+        self._th = Thread(target=self._release_encoded, daemon=True)
+        self._th.start()
+        impl.fmang.taps.append(self._tap)
+
+    def _tap(self, ref: impl.FrameRef):
+        with self._lock:
+            if len(self._pending) >= self.max_pending:
+                self.dropped += 1
+                ref.release()
+                return
+            self._pending[ref.seq] = ref
+        self._frames.put((ref._slot, ref.seq, ref.timestamp))
+
+    def _release_encoded(self):
+        while True:
+            msg = self._done.get()
+            if msg is None:
+                break
+            seq, ok = msg
+            with self._lock:
+                self._pending.pop(seq).release()
+                if ok:
+                    self.recorded += 1
+                else:
+                    self.dropped += 1
+
+    @property
+    def pending(self) -> int:
+        return len(self._pending)
+
+    def close(self, timeout: float = 10.0):
+        impl.fmang.taps.remove(self._tap)
+        self._frames.put(None)
+        self._proc.join(timeout)
+        if self._proc.is_alive():
+            logging.warning("Recorder process did not finish encoding, terminating it")
+            self._proc.terminate()
+            self._proc.join()
+            self._done.put(None)
+        self._th.join()
+        with self._lock:
+            for ref in self._pending.values():
+                ref.release()
+            self._pending.clear()
+        logging.info("Recorded %d frames to %s, dropped %d" % (self.recorded, self.path, self.dropped))
+
+
+def load_index(path: str) -> np.ndarray:
+    """
+    Opens the frame index of a recording without reading it into memory
+
+    Args:
+        path: Video file or its index file
+
+    Returns:
+        Read-only memory mapped [n] array with the fields seq and timestamp (ns); Element i describes frame i of the
+        video
+    """
+    path = os.path.splitext(path)[0] + ".idx"
+    with open(path, "rb") as f:
+        magic, version = header_fmt.unpack(f.read(header_fmt.size))
+    if magic != MAGIC:
+        raise ValueError("%s is not a frame index" % path)
+    if version > VERSION:
+        raise ValueError("Unsupported frame index version %d" % version)
+    return np.memmap(path, dtype=index_dtype, mode="r", offset=header_fmt.size)
+
+
+def frame_at(index: np.ndarray, timestamp: float) -> int:
+    """
+    Returns the number of the last frame captured at or before a time.monotonic() time in seconds, for seeking with
+    cv2.CAP_PROP_POS_FRAMES
+    """
+    return max(int(np.searchsorted(index["timestamp"], int(timestamp * 1e9), side="right")) - 1, 0)
+
+
+recorder: Optional[_Recorder] = None
+
+
+def start(path: str, fourcc: str = "FFV1"):
+    global recorder
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    recorder = _Recorder(path, fourcc)
+    metrics.queue_sources["recorder"] = lambda: recorder.pending if recorder is not None else 0
+    metrics.counters["recorder/dropped"] = lambda: recorder.dropped if recorder is not None else 0
+    logging.info("Recording frames to %s" % path)
+
+
+def stop():
+    global recorder
+    if recorder is not None:
+        recorder.close()
+        recorder = None
+
+
+if __name__ == "__main__":
+    for arg in sys.argv[1:]:
+        idx = load_index(arg)
+        if len(idx):
+            span = (idx["timestamp"][-1] - idx["timestamp"][0]) / 1e9
+            print("%s: %d frames over %.1f s, %d skipped sequence numbers" % (
+                arg, len(idx), span, idx["seq"][-1] - idx["seq"][0] + 1 - len(idx)))
+        else:
+            print("%s: no frames" % arg)
@@ -0,0 +1,316 @@
+import os
+import re
+import sys
+import json
+import time
+import struct
+import logging
+from array import array
+from collections import deque
+from threading import Thread, Lock
+from typing import Optional, List, Deque, Tuple, Iterator, Dict
+
+import numpy as np
+
+
+#
+# This file contains the logic for recording the data sent by extensions during a session
+#
+# Session file layout:
+#   header:  magic (4 bytes) | version (u16)
+#   records: payload length (u32) | kind (u8) | stream id (u16) | timestamp in ns on the time.monotonic clock (i64) |
+#            payload
+#
+# Every stream starts with a STREAM record whose payload is the utf-8 encoded stream name, followed by its data records
+#
+# After a session, the records are compacted into a columnar directory with one subdirectory per stream, with the records
+# of every stream sorted by timestamp:
+#   index.json                        stream names, kinds, record counts and time ranges
+#   <stream>/timestamp.npy            [n] int64 ns
+#   <stream>/values.npy               [n, k] float64, for VALUES streams
+#   <stream>/offsets.npy, data.bin    [n + 1] int64 byte offsets into the concatenated payloads, for DATA streams
+#
+
+MAGIC = b"IBSR"
+VERSION = 1
+
+header_fmt = struct.Struct("<4sH")
+record_fmt = struct.Struct("<IBHq")
+
+# Record kinds
+STREAM = 0
+DATA = 1
+VALUES = 2  # Payload is a float64 array
+
+
+class _Writer:  # Singleton
+    def __init__(self, path: str, flush_interval: float = 0.05, fsync_interval: float = 1.0):
+        self._file = open(path, "wb")
+        self._file.write(header_fmt.pack(MAGIC, VERSION))
+        self.path = path
+        self.flush_interval = flush_interval
+        self.fsync_interval = fsync_interval
+
+        # One queue per stream; deque appends are atomic, so extension threads never wait on each other or on the
+        # writer thread.  The lock is only used when registering new streams
+        self._queues: List[Deque[Tuple[int, int, bytes]]] = list()
+        self._names: List[str] = list()
+        self._dirs: Dict[str, str] = dict()  # Directory of the stream once compacted -> stream name
+        self._reg_lock = Lock()
+
+        self._running = True
+        self._th = Thread(target=self._run, daemon=True)
+        self._th.start()
+
+    def register(self, name: str) -> int:
+        with self._reg_lock:
+            # Compacting identifies streams by their name and directory, so both must be unique
+            _check_unique(self._dirs, name)
+            sid = len(self._queues)
+            queue = deque()
+            queue.append((time.monotonic_ns(), STREAM, name.encode("utf-8")))
+            self._names.append(name)
+            self._queues.append(queue)
+        return sid
+
+    def submit(self, sid: int, kind: int, payload: bytes, timestamp: Optional[float] = None):
+        stamp = time.monotonic_ns() if timestamp is None else int(timestamp * 1e9)
+        self._queues[sid].append((stamp, kind, payload))
+
+    def queue_depths(self):
+        return {name: len(queue) for name, queue in zip(self._names, self._queues)}
+
+    def _drain(self) -> int:
+        batch = bytearray()
+        for sid, queue in enumerate(list(self._queues)):
+            # Only draining what is currently queued so a busy stream can't starve the others
+            for _ in range(len(queue)):
+                stamp, kind, payload = queue.popleft()
+                batch += record_fmt.pack(len(payload), kind, sid, stamp)
+                batch += payload
+        if batch:
+            self._file.write(batch)
+        return len(batch)
+
+    def _run(self):
+        last_sync = time.monotonic()
+        while self._running:
+            time.sleep(self.flush_interval)
+            self._drain()
+            if time.monotonic() - last_sync >= self.fsync_interval:
+                self._sync()
+                last_sync = time.monotonic()
+
+    def _sync(self):
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def close(self):
+        self._running = False
+        self._th.join()
+        self._drain()
+        self._sync()
+        self._file.close()
+
+
+def read_records(path: str) -> Iterator[Tuple[int, int, str, int, bytes]]:
+    """
+    Iterates over the records of a session file
+
+    Returns:
+        Iterator of (kind, stream id, stream name, timestamp in ns, payload)
+    """
+    names = dict()
+    with open(path, "rb") as f:
+        magic, version = header_fmt.unpack(f.read(header_fmt.size))
+        if magic != MAGIC:
+            raise ValueError("%s is not a session file" % path)
+        if version > VERSION:
+            raise ValueError("Unsupported session file version %d" % version)
+        while True:
+            head = f.read(record_fmt.size)
+            if len(head) < record_fmt.size:
+                break
+            length, kind, sid, stamp = record_fmt.unpack(head)
+            payload = f.read(length)
+            if len(payload) < length:
+                logging.warning("Truncated record at the end of %s" % path)
+                break
+            if kind == STREAM:
+                names[sid] = payload.decode("utf-8")
+            yield kind, sid, names.get(sid, ""), stamp, payload
+
+
+def _stream_dir(name: str) -> str:
+    return re.sub(r"[^\w\-]+", "_", name)
+
+
+def _check_unique(dirs: Dict[str, str], name: str):
+    sdir = _stream_dir(name)
+    if sdir in dirs:
+        if dirs[sdir] == name:
+            raise ValueError("Stream %s is registered twice" % name)
+        raise ValueError("Streams %s and %s would be compacted into the same directory %s" % (dirs[sdir], name, sdir))
+    dirs[sdir] = name
+
+
+def compact(path: str, outdir: Optional[str] = None) -> str:
+    """
+    Converts a session file into columnar arrays which can be opened with load_session
+
+    Args:
+        path: Session file
+        outdir: Output directory; Defaults to the session file path without its extension
+
+    Returns:
+        Output directory
+    """
+    if outdir is None:
+        outdir = os.path.splitext(path)[0]
+
+    # First pass: sizing the columns of every stream, and ordering its records by timestamp
+    streams: Dict[int, dict] = dict()
+    dirs: Dict[str, str] = dict()
+    for kind, sid, name, stamp, payload in read_records(path):
+        if kind == STREAM:
+            _check_unique(dirs, name)
+            streams[sid] = {"name": name, "kind": None, "count": 0, "width": 0, "nbytes": 0,
+                            "stamps": array("q"), "lengths": array("q")}
+            continue
+        info = streams[sid]
+        if info["kind"] is None:
+            info["kind"] = kind
+            info["width"] = len(payload) // 8
+        if kind != info["kind"] or (kind == VALUES and len(payload) // 8 != info["width"]):
+            raise ValueError("Stream %s mixes record layouts and cannot be compacted" % name)
+        info["count"] += 1
+        info["nbytes"] += len(payload)
+        info["stamps"].append(stamp)
+        info["lengths"].append(len(payload))
+
+    # Extensions may send out of order timestamps; Time slicing needs sorted columns, so every record is written to the
+    # row given by its rank, and the payloads of DATA streams are laid out in that order
+    rows: Dict[int, np.ndarray] = dict()
+    for sid, info in streams.items():
+        stamps = np.frombuffer(info.pop("stamps"), dtype=np.int64)
+        lengths = np.frombuffer(info.pop("lengths"), dtype=np.int64)
+        order = np.argsort(stamps, kind="stable")
+        rows[sid] = np.empty(len(order), dtype=np.int64)
+        rows[sid][order] = np.arange(len(order))
+        info["offsets"] = np.concatenate(([0], np.cumsum(lengths[order])))
+
+    # Second pass: filling preallocated memory mapped columns
+    columns: Dict[int, Dict[str, np.ndarray]] = dict()
+    fill = dict()
+    for sid, info in streams.items():
+        if info["kind"] is None:
+            continue
+        sdir = os.path.join(outdir, _stream_dir(info["name"]))
+        os.makedirs(sdir, exist_ok=True)
+        n = info["count"]
+        cols = {"timestamp": np.lib.format.open_memmap(os.path.join(sdir, "timestamp.npy"), "w+", np.int64, (n,))}
+        if info["kind"] == VALUES:
+            cols["values"] = np.lib.format.open_memmap(
+                os.path.join(sdir, "values.npy"), "w+", np.float64, (n, info["width"]))
+        else:
+            cols["offsets"] = np.lib.format.open_memmap(os.path.join(sdir, "offsets.npy"), "w+", np.int64, (n + 1,))
+            cols["offsets"][...] = info["offsets"]
+            cols["data"] = np.memmap(os.path.join(sdir, "data.bin"), np.uint8, "w+", shape=(max(info["nbytes"], 1),))
+        columns[sid] = cols
+        fill[sid] = 0  # Record index
+    for kind, sid, name, stamp, payload in read_records(path):
+        if kind == STREAM:
+            continue
+        cols = columns[sid]
+        row = rows[sid][fill[sid]]
+        cols["timestamp"][row] = stamp
+        if kind == VALUES:
+            cols["values"][row] = np.frombuffer(payload, dtype=np.float64)
+        else:
+            off = streams[sid]["offsets"][row]
+            cols["data"][off:off + len(payload)] = np.frombuffer(payload, dtype=np.uint8)
+        fill[sid] += 1
+
+    index = dict()
+    for sid, cols in columns.items():
+        info = streams[sid]
+        ts = cols["timestamp"]
+        for col in cols.values():
+            col.flush()
+        index[info["name"]] = {
+            "dir": _stream_dir(info["name"]),
+            "kind": "values" if info["kind"] == VALUES else "data",
+            "count": info["count"],
+            "width": info["width"] if info["kind"] == VALUES else None,
+            "t_min": int(ts.min()) if len(ts) else None,
+            "t_max": int(ts.max()) if len(ts) else None,
+        }
+    with open(os.path.join(outdir, "index.json"), "w") as f:
+        json.dump(index, f, indent=2)
+    return outdir
+
+
+def load_session(path: str) -> Dict[str, Dict[str, np.ndarray]]:
+    """
+    Opens a compacted session without reading it into memory
+
+    Returns:
+        Dictionary of stream name -> column name -> read-only memory mapped array
+    """
+    with open(os.path.join(path, "index.json")) as f:
+        index = json.load(f)
+    session = dict()
+    for name, info in index.items():
+        sdir = os.path.join(path, info["dir"])
+        cols = {"timestamp": np.load(os.path.join(sdir, "timestamp.npy"), mmap_mode="r")}
+        if info["kind"] == "values":
+            cols["values"] = np.load(os.path.join(sdir, "values.npy"), mmap_mode="r")
+        else:
+            cols["offsets"] = np.load(os.path.join(sdir, "offsets.npy"), mmap_mode="r")
+            cols["data"] = np.memmap(os.path.join(sdir, "data.bin"), np.uint8, "r")
+        session[name] = cols
+    return session
+
+
+def time_slice(cols: Dict[str, np.ndarray], start: float, end: float) -> Dict[str, np.ndarray]:
+    """
+    Slices the columns of a stream to the records with start <= timestamp < end without copying; Compacted columns are
+    always sorted by timestamp
+
+    Args:
+        cols: Columns of a stream returned by load_session
+        start: time.monotonic() time in seconds
+        end: time.monotonic() time in seconds
+    """
+    ts = cols["timestamp"]
+    i, j = np.searchsorted(ts, [int(start * 1e9), int(end * 1e9)])
+    if "values" in cols:
+        return {"timestamp": ts[i:j], "values": cols["values"][i:j]}
+    return {"timestamp": ts[i:j], "offsets": cols["offsets"][i:j + 1], "data": cols["data"]}
+
+
+writer: Optional[_Writer] = None
+
+
+def register(name: str) -> Optional[int]:
+    return writer.register(name) if writer is not None else None
+
+
+def start(path: str):
+    global writer
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    writer = _Writer(path)
+    logging.info("Recording session data to %s" % path)
+
+
+def stop():
+    global writer
+    if writer is not None:
+        writer.close()
+        writer = None
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    for arg in sys.argv[1:]:
+        logging.info("Compacted %s into %s" % (arg, compact(arg)))
@@ -0,0 +1,35 @@
+import time
+
+import ibs
+
+# Extensions run by test_extproc; The child process imports them by module name
+
+running = True
+
+
+def startup(api, widget):
+    while running:
+        time.sleep(0.01)
+
+
+def shutdown():
+    global running
+    running = False
+
+
+class Extension(ibs.IbsExt):
+    @staticmethod
+    def get_name() -> str:
+        return "Process Test"
+
+    def startup_ref(self):
+        if self.options == "exit":
+            return lambda api, widget: None
+        if self.options == "fail":
+            def fail(api, widget):
+                raise RuntimeError("Extension failed on purpose")
+            return fail
+        return startup
+
+    def shutdown_ref(self):
+        return shutdown
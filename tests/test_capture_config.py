@@ -0,0 +1,16 @@
+from impl import CaptureConfig
+
+
+def test_union_takes_the_largest_of_each_dimension():
+    out = CaptureConfig.union([CaptureConfig(width=1920), CaptureConfig(640, 480)])
+    assert (out.width, out.height) == (1920, 480)
+    out = CaptureConfig.union([CaptureConfig(640, 480), None, CaptureConfig(height=720)])
+    assert (out.width, out.height) == (640, 720)
+
+
+def test_union():
+    out = CaptureConfig.union([CaptureConfig(640, 480, fps=30, buffer_size=4), CaptureConfig(fps=60, fourcc="MJPG"),
+                               CaptureConfig(buffer_size=1)])
+    assert (out.width, out.height, out.fps, out.fourcc, out.buffer_size) == (640, 480, 60, "MJPG", 1)
+    out = CaptureConfig.union([None, None])
+    assert (out.width, out.height, out.fps, out.fourcc, out.buffer_size) == (None, None, None, None, None)
@@ -0,0 +1,56 @@
+import math
+
+import numpy as np
+import pytest
+
+pytest.importorskip("dlib")
+pytest.importorskip("imutils")
+
+from extensions.blink_detector.detector import BlinkSummary, OnlineBlinkDetector, measure, measure_batch  # noqa: E402
+
+
+def scalar_ear(kpts):
+    # Eye aspect ratio of a single eye, as computed before it was vectorized
+    return (math.dist(kpts[1], kpts[5]) + math.dist(kpts[2], kpts[4])) / (2 * math.dist(kpts[0], kpts[3]))
+
+
+def test_measure_batch():
+    kpts = np.random.default_rng(0).integers(0, 500, (20, 12, 2))
+    ears = measure_batch(kpts)
+    assert ears.shape == (20, 2)
+    for k, (left, right) in zip(kpts, ears):
+        assert left == pytest.approx(scalar_ear(k[:6]))
+        assert right == pytest.approx(scalar_ear(k[6:]))
+    assert measure(kpts[0]) == pytest.approx(tuple(ears[0]))
+
+
+def run(detector, ears, period=0.01):
+    return [e for i, ear in enumerate(ears) for e in detector.update(ear, i * period)]
+
+
+def test_blink():
+    events = run(OnlineBlinkDetector(), [0.3] * 5 + [0.1] * 10 + [0.3] * 5)
+    assert len(events) == 2
+    start, end = events
+    assert start[0] == OnlineBlinkDetector.START and start[1] == pytest.approx(0.05) and math.isnan(start[2])
+    assert end[0] == OnlineBlinkDetector.END and end[1] == pytest.approx(0.05) and end[2] == pytest.approx(0.1)
+
+
+def test_blink_hysteresis():
+    # Rising between the close and open thresholds does not end the blink
+    events = run(OnlineBlinkDetector(), [0.3] * 5 + [0.1] * 10 + [0.22] * 5 + [0.1] * 5 + [0.3] * 5)
+    assert [e[0] for e in events] == [OnlineBlinkDetector.START, OnlineBlinkDetector.END]
+    assert events[1][2] == pytest.approx(0.2)
+
+
+def test_short_closures_are_ignored():
+    assert run(OnlineBlinkDetector(min_duration=0.05), [0.3] * 5 + [0.1] * 3 + [0.3] * 5) == []
+
+
+def test_summary():
+    summary = BlinkSummary(period=1.0)
+    rows = [summary.update(t / 10, (0.2, 0.4) if t % 2 else None, int(t == 3)) for t in range(11)]
+    assert rows[:10] == [None] * 10
+    frames, faces, blinks, left, right = rows[10]
+    assert (frames, faces, blinks) == (10, 5, 1)
+    assert (left, right) == pytest.approx((0.2, 0.4))
@@ -0,0 +1,37 @@
+from threading import Thread
+
+import pytest
+
+import ibs
+import impl
+import extproc
+from process_ext import Extension
+
+
+@pytest.fixture
+def frames():
+    impl.start(impl.SyntheticSource(64, 48, frames=1000, realtime=True))
+    yield
+    impl.stop()
+
+
+def stop(proc: extproc.ExtProcess, timeout: float = 20.0) -> bool:
+    th = Thread(target=proc.stop, daemon=True)
+    th.start()
+    th.join(timeout)
+    return not th.is_alive()
+
+
+@pytest.mark.parametrize("options", ["exit", "fail"])
+def test_stop_after_the_child_exited(frames, options):
+    # Extensions leave startup on their own when a replay ends, or when they fail
+    proc = extproc.ExtProcess(Extension(options), ibs.API(Extension.get_name()))
+    proc._proc.join(20.0)
+    assert not proc._proc.is_alive()
+    assert stop(proc)
+
+
+def test_stop(frames):
+    proc = extproc.ExtProcess(Extension(None), ibs.API(Extension.get_name()))
+    assert stop(proc)
+    assert proc._proc.exitcode == 0  # Shut down by the extension rather than terminated
@@ -0,0 +1,181 @@
+import gc
+import time
+from threading import Thread
+
+import cv2
+import numpy as np
+import pytest
+
+import impl
+
+
+@pytest.fixture
+def manager():
+    managers = list()
+
+    def start(source: impl.FrameSource, nslots: int = 8) -> impl._FrameManager:
+        managers.append(impl._FrameManager(source, nslots))
+        return managers[-1]
+    yield start
+    for mang in managers:
+        mang.close()
+
+
+def test_sequence_numbers(manager):
+    # Frames replayed as fast as they are consumed are never skipped
+    mang = manager(impl.SyntheticSource(64, 48, frames=20))
+    seqs, seq = list(), -1
+    while True:
+        ref = mang.wait_frame(seq, timeout=1.0)
+        if ref is None:
+            break
+        with ref:
+            seq = ref.seq
+        seqs.append(seq)
+    assert seqs == list(range(20))
+
+
+def test_sequence_gaps(manager):
+    # A reader slower than the camera sees gaps in the sequence numbers
+    mang = manager(impl.SyntheticSource(64, 48, frames=60, realtime=True, fps=200))
+    seqs, seq = list(), -1
+    while not mang.finished:
+        ref = mang.wait_frame(seq, timeout=1.0)
+        if ref is None:
+            break
+        with ref:
+            seq = ref.seq
+        seqs.append(seq)
+        time.sleep(0.02)
+    assert all(b > a for a, b in zip(seqs, seqs[1:]))
+    assert any(b - a > 1 for a, b in zip(seqs, seqs[1:]))
+
+
+def test_drops_when_every_slot_is_borrowed(manager):
+    mang = manager(impl.SyntheticSource(64, 48, frames=100, realtime=True, fps=500), nslots=4)
+    refs, seq = list(), -1
+    while len(refs) < 4:
+        ref = mang.wait_frame(seq, timeout=1.0)
+        seq = ref.seq
+        refs.append((ref, ref.frame.copy()))
+    time.sleep(0.1)
+    assert mang.dropped > 0
+    for ref, frame in refs:
+        np.testing.assert_array_equal(ref.frame, frame)  # Borrowed slots are never overwritten
+        ref.release()
+    assert mang.wait_frame(seq, timeout=1.0) is not None
+
+
+def test_garbage_collected_release(manager):
+    mang = manager(impl.SyntheticSource(64, 48, frames=5))
+    ref = mang.borrow_frame()
+    cycle = [ref]
+    cycle.append(cycle)
+    del ref, cycle
+    with mang._lock:
+        gc.collect()  # Finalizing the reference must not take the lock held by this thread
+        mang._apply_deferred()
+        assert sum(mang._refs) == 0
+
+
+def test_end_of_source(manager, tmp_path):
+    frames = np.random.default_rng(0).integers(0, 255, (5, 48, 64, 3), dtype=np.uint8)
+    np.save(tmp_path / "frames.npy", frames)
+    mang = manager(impl.ReplaySource(str(tmp_path / "frames.npy"), realtime=False))
+    seq = -1
+    for expected in frames:
+        with mang.wait_frame(seq, timeout=1.0) as ref:
+            seq = ref.seq
+            np.testing.assert_array_equal(ref.frame, expected)
+    start = time.monotonic()
+    assert mang.wait_frame(seq) is None  # Returns without a timeout once the source is finished
+    assert time.monotonic() - start < 1.0
+    assert mang.finished
+
+
+def test_views_are_shared(manager):
+    mang = manager(impl.SyntheticSource(64, 48, frames=5))
+    with mang.borrow_frame() as ref:
+        small = ref.view(width=32)
+        assert small.shape == (24, 32, 3)
+        assert not small.flags.writeable
+        assert ref.view(width=32) is small
+        assert ref.view(height=24) is not small  # A different transform
+        gray = ref.view(width=32, color=cv2.COLOR_BGR2GRAY)
+        np.testing.assert_array_equal(gray, cv2.cvtColor(small, cv2.COLOR_BGR2GRAY))
+        assert ref.view() is ref.frame
+
+        mang.views.evict_before(ref.seq + 1)
+        assert ref.view(width=32) is not small
+
+
+def test_views_are_evicted_with_their_frame(manager):
+    mang = manager(impl.SyntheticSource(64, 48, frames=10), nslots=3)
+    with mang.wait_frame() as ref:
+        seq = ref.seq
+        ref.view(width=32)
+    assert seq in mang.views._views
+    last = seq
+    for _ in range(4):  # Cycling through the ring, so the slot of the first frame is reused
+        with mang.wait_frame(last, timeout=1.0) as ref:
+            last = ref.seq
+    assert seq not in mang.views._views
+
+
+def test_borrow_closest_without_reading(manager):
+    # A reader borrowing the frame of its result again, like the blink preview, must not make the other reader skip it
+    mang = manager(impl.SyntheticSource(64, 48, frames=30, consumers=2))
+    seen = {"a": list(), "b": list()}
+
+    def reader(name: str):
+        seq = -1
+        while True:
+            ref = mang.wait_frame(seq, timeout=5.0)
+            if ref is None:
+                break
+            with ref:
+                seq = ref.seq
+            seen[name].append(seq)
+            if name == "a":
+                mang.borrow_closest(ref.timestamp, read=False).release()
+    threads = [Thread(target=reader, args=(name,)) for name in seen]
+    for th in threads:
+        th.start()
+    for th in threads:
+        th.join()
+    assert seen["a"] == seen["b"] == list(range(30))
+
+
+class _ModeChanges(impl.FrameSource):
+    # Never reads into the given buffer, like a camera which changed modes
+    realtime = False
+
+    def __init__(self, shapes):
+        self._shapes = list(shapes)
+
+    @property
+    def finished(self) -> bool:
+        return not self._shapes
+
+    def read(self, buf=None):
+        if not self._shapes:
+            return False, None, time.monotonic()
+        return True, np.full(self._shapes.pop(0), 100, dtype=np.uint8), time.monotonic()
+
+
+def test_mode_changes(manager, caplog):
+    shapes = [(48, 64, 3), (48, 64, 3), (96, 128, 3), (96, 128, 3), (48, 64), (48, 64), (48, 64, 3)]
+    mang = manager(_ModeChanges(shapes))
+    seqs, seq = list(), -1
+    while True:
+        ref = mang.wait_frame(seq, timeout=1.0)
+        if ref is None:
+            break
+        with ref:
+            assert ref.frame.shape == (48, 64, 3)
+            seq = ref.seq
+        seqs.append(seq)
+    assert seqs == list(range(5))  # The grayscale frames are dropped
+    warnings = [r for r in caplog.records if "camera changed" in r.getMessage()]
+    assert [r.levelname for r in warnings] == ["WARNING", "ERROR"]
+    assert "resizing" in warnings[0].getMessage() and "resizing" not in warnings[1].getMessage()
@@ -0,0 +1,38 @@
+from governor import Governor
+
+period = 1 / 30
+
+
+def run(gov: Governor, cost, frames: int = 3000):
+    # cost: processing time of a frame at the resolution scale of the governor
+    for _ in range(frames):
+        gov.observe(cost(gov.scale))
+
+
+def test_stride_converges():
+    # Too slow even at the lowest resolution; Every other frame is enough, so the stride must not climb to max_stride
+    gov = Governor(target=period)
+    run(gov, lambda scale: 1.5 * period)
+    assert (gov.scale, gov.stride) == (Governor.scales[-1], 2)
+
+
+def test_recovers():
+    gov = Governor(target=period)
+    run(gov, lambda scale: 3.5 * period)
+    assert gov.stride == 4
+    run(gov, lambda scale: 0.3 * period)
+    assert (gov.scale, gov.stride) == (1.0, 1)
+
+
+def test_resolution_converges():
+    # The processing time scales with the area of the frame, so a lower resolution keeps up without skipping frames
+    gov = Governor(target=period)
+    run(gov, lambda scale: 1.5 * period * scale ** 2)
+    assert (gov.scale, gov.stride) == (0.8, 1)
+
+
+def test_max_stride():
+    # Services processing every frame only lower the resolution
+    gov = Governor(target=period, max_stride=1)
+    run(gov, lambda scale: 2 * period)
+    assert (gov.scale, gov.stride) == (Governor.scales[-1], 1)
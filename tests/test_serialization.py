@@ -0,0 +1,88 @@
+import numpy as np
+import pytest
+
+import serialization
+from serialization import DATA, VALUES
+
+
+def record(tmp_path, streams):
+    # streams: name -> list of (kind, payload, timestamp in seconds)
+    path = str(tmp_path / "session.ibs")
+    serialization.start(path)
+    try:
+        for name, records in streams.items():
+            sid = serialization.register(name)
+            for kind, payload, stamp in records:
+                serialization.writer.submit(sid, kind, payload, stamp)
+    finally:
+        serialization.stop()
+    return path
+
+
+def values(*v):
+    return np.array(v, dtype=np.float64).tobytes()
+
+
+def test_round_trip(tmp_path):
+    path = record(tmp_path, {
+        "blink_detector/ear": [(VALUES, values(i, 2 * i), 1 + i / 10) for i in range(10)],
+        "blink_detector": [(DATA, bytes([i]) * i, 1 + i / 10) for i in range(10)],
+    })
+    session = serialization.load_session(serialization.compact(path))
+    assert set(session) == {"blink_detector/ear", "blink_detector"}
+
+    ear = session["blink_detector/ear"]
+    assert ear["values"].shape == (10, 2)
+    np.testing.assert_array_equal(ear["values"][:, 0], np.arange(10))
+    np.testing.assert_array_equal(ear["values"][:, 1], 2 * np.arange(10))
+
+    data = session["blink_detector"]
+    offsets = data["offsets"]
+    assert [bytes(data["data"][offsets[i]:offsets[i + 1]]) for i in range(10)] == [bytes([i]) * i for i in range(10)]
+
+
+def test_time_slice(tmp_path):
+    path = record(tmp_path, {
+        "values": [(VALUES, values(i), 1 + i / 10) for i in range(10)],
+        "data": [(DATA, bytes([i]) * (i + 1), 1 + i / 10) for i in range(10)],
+    })
+    session = serialization.load_session(serialization.compact(path))
+
+    part = serialization.time_slice(session["values"], 1.15, 1.45)
+    np.testing.assert_array_equal(part["values"][:, 0], [2, 3, 4])
+
+    part = serialization.time_slice(session["data"], 1.15, 1.45)
+    assert len(part["timestamp"]) == 3
+    offsets = part["offsets"]
+    payloads = [bytes(part["data"][offsets[i]:offsets[i + 1]]) for i in range(3)]
+    assert payloads == [bytes([i]) * (i + 1) for i in (2, 3, 4)]
+
+
+def test_unsorted_values_are_sorted(tmp_path):
+    stamps = [1.0, 1.3, 1.1, 1.2]
+    path = record(tmp_path, {"values": [(VALUES, values(t), t) for t in stamps]})
+    cols = serialization.load_session(serialization.compact(path))["values"]
+    assert np.all(np.diff(cols["timestamp"]) >= 0)
+    np.testing.assert_array_equal(cols["values"][:, 0], sorted(stamps))
+
+
+def test_unsorted_data_is_sorted(tmp_path):
+    stamps = [1.0, 1.3, 1.1, 1.2]
+    path = record(tmp_path, {"data": [(DATA, str(t).encode() * (i + 1), t) for i, t in enumerate(stamps)]})
+    cols = serialization.load_session(serialization.compact(path))["data"]
+    np.testing.assert_array_equal(cols["timestamp"], [int(t * 1e9) for t in sorted(stamps)])
+
+    part = serialization.time_slice(cols, 1.05, 1.25)
+    offsets = part["offsets"]
+    assert [bytes(part["data"][offsets[i]:offsets[i + 1]]) for i in range(2)] == [b"1.1" * 3, b"1.2" * 4]
+
+
+@pytest.mark.parametrize("names", [("dup", "dup"), ("a/b", "a_b")])
+def test_stream_name_collisions(tmp_path, names):
+    serialization.start(str(tmp_path / "session.ibs"))
+    try:
+        serialization.register(names[0])
+        with pytest.raises(ValueError):
+            serialization.register(names[1])
+    finally:
+        serialization.stop()